@@ -3,7 +3,9 @@ import numpy as np
 from itertools import combinations_with_replacement
 
 from .core import Data, Summary, Propensity, PropensitySelect, Strata
-from .estimators import OLS, Blocking, Weighting, Matching, Estimators
+from .core import Permutation
+from .estimators import OLS, Blocking, Weighting, Matching, Bootstrap
+from .estimators import Estimators, Sweep
 
 
 class CausalModel(object):
@@ -12,9 +14,29 @@ class CausalModel(object):
 	Class that provides the main tools of Causal Inference.
 	"""
 
-	def __init__(self, Y, D, X):
+	def __init__(self, Y, D, X, dtype=None):
 
-		self.old_data = Data(Y, D, X)
+		"""
+		Parameters
+		----------
+		Y: array-like
+			Vector of observed outcomes.
+		D: array-like
+			Vector of treatment status indicators.
+		X: array-like
+			Matrix of covariates.
+		dtype: data-type, optional
+			Storage type of the covariate matrix, e.g.
+			np.float32 to halve its memory footprint and
+			speed up propensity score estimation and
+			blocked matching searches. Means, Gram matrices,
+			and likelihoods are still accumulated in double
+			precision, and regression estimators work in
+			double precision throughout. Defaults to the
+			type of X.
+		"""
+
+		self.old_data = Data(Y, D, X, dtype)
 		self.reset()
 
 
@@ -33,9 +55,11 @@ class CausalModel(object):
 		self.blocks = None
 		self.strata = None
 		self.estimates = Estimators()
+		self.permutation = None
+		self.sweep = None
 
 
-	def est_propensity(self, lin='all', qua=None):
+	def est_propensity(self, lin='all', qua=None, solver='newton'):
 
 		"""
 		Estimates the propensity scores given list of covariates to
@@ -59,17 +83,26 @@ class CausalModel(object):
 			and including the product of the 3rd and 4th
 			columns. Default is to not include any
 			quadratic terms.
+		solver: string, optional
+			Optimization method for the logistic
+			regression. Defaults to 'newton', which uses
+			Newton-Raphson with the analytic Hessian and
+			reuses its factorization for the standard
+			errors. Set to 'bfgs' to use SciPy's BFGS
+			routine instead.
 		"""
 
 		lin_terms = parse_lin_terms(self.raw_data['K'], lin)
 		qua_terms = parse_qua_terms(self.raw_data['K'], qua)
 
-		self.propensity = Propensity(self.raw_data, lin_terms, qua_terms)
+		self.propensity = Propensity(self.raw_data, lin_terms, qua_terms,
+		                             solver)
 		self.raw_data._dict['pscore'] = self.propensity['fitted']
 		self._post_pscore_init()
 
 
-	def est_propensity_s(self, lin_B=None, C_lin=1, C_qua=2.71):
+	def est_propensity_s(self, lin_B=None, C_lin=1, C_qua=2.71,
+	                     solver='newton', n_jobs=1):
 	
 		"""
 		Estimates the propensity score with covariates selected using
@@ -99,6 +132,16 @@ class CausalModel(object):
 			to decide whether candidate quadratic terms
 			should be included. Defaults to 2.71 as in
 			[1]_.
+		solver: string, optional
+			Optimization method for the logistic
+			regressions, either 'newton' or 'bfgs'.
+			Defaults to 'newton'.
+		n_jobs: int, optional
+			Number of worker threads that fit the
+			candidate models of each selection step
+			concurrently. Set to -1 to use one thread
+			per CPU. The selected terms are identical to
+			those of the serial search. Defaults to 1.
 
 		References
 		----------
@@ -110,7 +153,7 @@ class CausalModel(object):
 		lin_basic = parse_lin_terms(self.raw_data['K'], lin_B)
 
 		self.propensity = PropensitySelect(self.raw_data, lin_basic,
-		                                   C_lin, C_qua)
+		                                   C_lin, C_qua, solver, n_jobs)
 		self.raw_data._dict['pscore'] = self.propensity['fitted']
 		self._post_pscore_init()
 
@@ -126,6 +169,10 @@ class CausalModel(object):
 
 		This method should only be executed after the propensity score
 		has been estimated.
+
+		The retained units keep their original order, so outcomes
+		passed to est_via_ols can be aligned with the trimmed data
+		by applying the same mask to them.
 		"""
 
 		if 0 < self.cutoff <= 0.5:
@@ -139,6 +186,8 @@ class CausalModel(object):
 			self.summary_stats = Summary(self.raw_data)
 			self.strata = None
 			self.estimates = Estimators()
+			self.permutation = None
+			self.sweep = None
 		elif self.cutoff == 0:
 			pass
 		else:
@@ -183,7 +232,6 @@ class CausalModel(object):
 		has been estimated.
 		"""
 
-		Y, D, X = self.raw_data['Y'], self.raw_data['D'], self.raw_data['X']
 		pscore = self.raw_data['pscore']
 
 		if isinstance(self.blocks, int):
@@ -192,11 +240,7 @@ class CausalModel(object):
 			blocks = self.blocks[:]  # make a copy; should be sorted
 			blocks[0] = 0  # avoids always dropping 1st unit
 
-		def subset(p_low, p_high):
-			return (p_low < pscore) & (pscore <= p_high)
-		subsets = [subset(*ps) for ps in zip(blocks, blocks[1:])]
-		strata = [CausalModel(Y[s], D[s], X[s]) for s in subsets]
-		self.strata = Strata(strata, subsets, pscore)
+		self.strata = Strata(self.raw_data, blocks)
 
 
 	def stratify_s(self):
@@ -229,7 +273,7 @@ class CausalModel(object):
 		self.stratify()
 
 
-	def est_via_ols(self, adj=2):
+	def est_via_ols(self, adj=2, Y=None, se='robust', B=1000, seed=None):
 
 		"""
 		Estimates average treatment effects using least squares.
@@ -243,12 +287,34 @@ class CausalModel(object):
 			indicator D and covariates X separately. Set
 			adj = 2 to additionally include interaction
 			terms between D and X. Defaults to 2.
+		Y: array, optional
+			Matrix of outcomes, one column per outcome,
+			to use in place of the outcome of the model.
+			Its rows must correspond to those of the
+			current data; trimming keeps the remaining
+			rows in their original order. The design
+			matrix is factored once and shared by all
+			outcomes, and each estimate and standard
+			error becomes an array with one entry per
+			outcome. Defaults to the model's outcome.
+		se: str
+			Method for standard errors. Defaults to
+			'robust', the heteroskedasticity-robust
+			sandwich estimator. Setting 'wild' uses a
+			wild bootstrap with Rademacher multipliers,
+			all of whose replicates are computed from
+			one pass over the data in blocks of rows.
+		B: int
+			Number of wild bootstrap replicates. Defaults
+			to 1000.
+		seed: int, optional
+			Seed of the wild bootstrap multipliers.
 		"""
 
-		self.estimates['ols'] = OLS(self.raw_data, adj)
+		self.estimates['ols'] = OLS(self.raw_data, adj, Y, se, B, seed)
 
 
-	def est_via_blocking(self, adj=1):
+	def est_via_blocking(self, adj=1, n_jobs=1):
 
 		"""
 		Estimates average treatment effects using regression within
@@ -267,22 +333,40 @@ class CausalModel(object):
 			and covariates X separately. Set adj = 2 to
 			additionally include interaction terms between
 			D and X. Defaults to 1.
+		n_jobs: int, optional
+			Number of threads fitting the within-bin
+			regressions concurrently. Set n_jobs = -1
+			to use one thread per CPU. Defaults to 1.
 		"""
 
-		self.estimates['blocking'] = Blocking(self.strata, adj)
+		self.estimates['blocking'] = Blocking(self.strata, adj, n_jobs)
 
 
-	def est_via_weighting(self):
+	def est_via_weighting(self, se='robust', B=1000, seed=None):
 
 		"""
 		Estimates average treatment effects using doubly-robust
 		version of the Horvitz-Thompson weighting estimator.
+
+		Parameters
+		----------
+		se: str
+			Method for standard errors, 'robust' or
+			'wild', as in est_via_ols. Defaults to
+			'robust'.
+		B: int
+			Number of wild bootstrap replicates. Defaults
+			to 1000.
+		seed: int, optional
+			Seed of the wild bootstrap multipliers.
 		"""
 
-		self.estimates['weighting'] = Weighting(self.raw_data)
+		self.estimates['weighting'] = Weighting(self.raw_data, se=se,
+		                                        B=B, seed=seed)
 
 
-	def est_via_matching(self, weights='inv', matches=1, bias_adj=False):
+	def est_via_matching(self, weights='inv', matches=1, bias_adj=False,
+	                     search='kdtree', block_mem=2**26, n_jobs=1, eps=0):
 
 		"""
 		Estimates average treatment effects using nearest-
@@ -305,6 +389,36 @@ class CausalModel(object):
 		bias_adj: bool
 			Specifies whether bias adjustments should be
 			attempted.
+		search: str
+			Nearest-neighbor search method. Defaults to
+			'kdtree', which queries a KD-tree built on
+			the covariates rescaled by the weighting
+			matrix. Setting 'blocked' computes distances
+			for tiles of units at once through matrix
+			products, and 'brute' computes the distance
+			vector of each unit separately. All methods
+			return the same matches, ties included.
+		block_mem: int
+			Approximate memory budget, in bytes, for each
+			tile of distances when search is 'blocked'.
+			Applies to each worker separately. Defaults
+			to 2**26 (64 MB).
+		n_jobs: int
+			Number of worker threads that search for
+			matches concurrently. Set to -1 to use one
+			thread per CPU. Results are identical to the
+			serial search. Defaults to 1.
+		eps: scalar
+			Tolerance for approximate matching with
+			search='kdtree'. If positive, the search may
+			return matches up to (1+eps) times as far as
+			the exact ones, trading accuracy for speed,
+			and ties are no longer expanded. The realized
+			relative increase in match distance, measured
+			against exact matching on a sample of units,
+			is reported under the key 'inflation'. Other
+			search methods require eps to be 0. Defaults
+			to 0, which gives exact matching.
 
 		References
 		----------
@@ -313,23 +427,152 @@ class CausalModel(object):
 			Introduction.
 		"""
 
-		X, K = self.raw_data['X'], self.raw_data['K']
-		X_c, X_t = self.raw_data['X_c'], self.raw_data['X_t']
-
-		if weights == 'inv':
-			W = 1/X.var(0)
-		elif weights == 'maha':
-			V_c = np.cov(X_c, rowvar=False, ddof=0)
-			V_t = np.cov(X_t, rowvar=False, ddof=0)
-			if K == 1:
-				W = 1/np.array([[(V_c+V_t)/2]])  # matrix form
-			else:
-				W = np.linalg.inv((V_c+V_t)/2)
-		else:
-			W = weights
+		W = calc_weighting_matrix(self.raw_data, weights)
+		self.estimates['matching'] = Matching(self.raw_data, W, matches,
+		                                      bias_adj, search, block_mem,
+		                                      n_jobs, eps)
+
+
+	def bootstrap(self, estimator='ols', B=200, n_jobs=1, seed=None,
+	              **kwargs):
+
+		"""
+		Computes bootstrap standard errors of an estimator.
+
+		Resamples are drawn within the control and treated groups
+		(within each group of each stratum for blocking), and the
+		propensity score and strata are held fixed. For OLS,
+		weighting, and blocking, resamples enter the fit as
+		multinomial frequency weights instead of copies of the
+		data. Results are stored under the key estimator +
+		'_bootstrap' and include the replicate estimates.
+
+		The bootstrap is not valid for matching estimators; see
+		the Bootstrap class for details.
+
+		Parameters
+		----------
+		estimator: str
+			One of 'ols', 'weighting', 'blocking', and
+			'matching'. Weighting requires the propensity
+			score, and blocking a stratified sample.
+			Defaults to 'ols'.
+		B: int
+			Number of bootstrap replicates. Defaults to 200.
+		n_jobs: int
+			Number of threads computing replicates
+			concurrently. Set to -1 to use one thread per
+			CPU. Results do not depend on n_jobs.
+			Defaults to 1.
+		seed: int, optional
+			Seed of the random number generator. Results
+			are reproducible under a given seed.
+		**kwargs
+			Options of the estimator: adj for OLS and
+			blocking, and weights, matches, bias_adj,
+			search, block_mem, and eps for matching, with
+			the same meaning and defaults as in the
+			corresponding est_via_* methods.
+		"""
+
+		if estimator == 'blocking' and self.strata is None:
+			raise ValueError('Blocking requires a stratified sample.')
+		if estimator == 'matching':
+			weights = kwargs.pop('weights', 'inv')
+			kwargs['W'] = calc_weighting_matrix(self.raw_data, weights)
+
+		bootstrap = Bootstrap(self.raw_data, estimator, B, n_jobs, seed,
+		                      self.strata, **kwargs)
+		self.estimates[estimator+'_bootstrap'] = bootstrap
+
+
+	def permutation_test(self, statistic='rdiff', P=1000, adj=1,
+	                     within_strata=False, batch=100, tol=None,
+	                     n_jobs=1, seed=None):
+
+		"""
+		Performs a Fisher randomization test of the sharp null
+		hypothesis that the treatment has no effect on any unit.
+
+		The treatment indicators are permuted at random and the
+		test statistic is recomputed for every permutation, giving
+		its distribution under the null. Batches of permutations
+		are evaluated at once in matrix form. Results are stored
+		in the attribute permutation.
+
+		Parameters
+		----------
+		statistic: str
+			Test statistic. Defaults to 'rdiff', the raw
+			difference in mean outcomes. Setting 'ols'
+			uses the OLS estimate of the average
+			treatment effect.
+		P: int
+			Maximum number of permutations. Defaults to
+			1000.
+		adj: int (0, 1, or 2)
+			Covariate adjustment of the OLS statistic, as
+			in est_via_ols. Defaults to 1.
+		within_strata: bool
+			Permutes treatment only within the propensity
+			score strata if True. Requires a stratified
+			sample. Defaults to False.
+		batch: int
+			Number of permutations evaluated at once.
+			Each batch takes 8*N*batch bytes, so lower
+			it for large samples. Defaults to 100.
+		tol: float, optional
+			Stops once the Monte Carlo standard error of
+			the p-value is at most tol. By default all P
+			permutations are used.
+		n_jobs: int
+			Number of threads evaluating batches
+			concurrently. Set to -1 to use one thread per
+			CPU. Results do not depend on n_jobs.
+			Defaults to 1.
+		seed: int, optional
+			Seed of the random number generator.
+		"""
+
+		if within_strata and self.strata is None:
+			raise ValueError('Permuting within strata requires a '
+			                 'stratified sample.')
+		groups = self.strata.labels() if within_strata else None
+		self.permutation = Permutation(self.raw_data, statistic, P,
+		                               groups, batch, tol, n_jobs,
+		                               seed, adj)
 
-		self.estimates['matching'] = Matching(self.raw_data, W,
-		                                      matches, bias_adj)
+
+	def trim_sweep(self, cutoffs, estimators=('ols',), adj=2):
+
+		"""
+		Computes summary statistics and treatment effect estimates
+		on the subsamples obtained by trimming at each of a list
+		of cutoffs, as a check of their sensitivity to the cutoff.
+
+		Since the subsamples are nested, units are sorted once by
+		propensity score and each fit is updated from the previous
+		one with the units it adds, instead of being redone from
+		scratch. The data are left untrimmed. Results are stored
+		in the attribute sweep.
+
+		This method should only be executed after the propensity
+		score has been estimated.
+
+		Parameters
+		----------
+		cutoffs: array-like
+			Trimming cutoffs, each 0 or in (0, 0.5], as
+			for the attribute cutoff.
+		estimators: tuple or list
+			Estimators to compute, among 'ols' and
+			'weighting'. Defaults to ('ols',).
+		adj: int (0, 1, or 2)
+			Covariate adjustment of OLS, as in
+			est_via_ols. Defaults to 2.
+		"""
+
+		self.sweep = Sweep(self.raw_data, cutoffs, estimators, adj)
 
 
 	def _post_pscore_init(self):
@@ -338,6 +581,25 @@ class CausalModel(object):
 		self.blocks = 5
 
 
+def calc_weighting_matrix(data, weights):
+
+	# Weighting matrix of the matching distance: inverse variances for
+	# 'inv', the Mahalanobis metric for 'maha', or weights itself.
+
+	X, K = data['X'], data['K']
+	if weights == 'inv':
+		return 1/X.var(0, dtype=np.float64)
+	elif weights == 'maha':
+		V_c = np.cov(data['X_c'], rowvar=False, ddof=0)
+		V_t = np.cov(data['X_t'], rowvar=False, ddof=0)
+		if K == 1:
+			return 1/np.array([[(V_c+V_t)/2]])  # matrix form
+		else:
+			return np.linalg.inv((V_c+V_t)/2)
+	else:
+		return weights
+
+
 def parse_lin_terms(K, lin):
 
 	if lin is None:
@@ -360,9 +622,14 @@ def parse_qua_terms(K, qua):
 
 def sumlessthan(g, sorted_g, cumsum):
 
-	deduped_values = dict(zip(sorted_g, cumsum))
+	# For each element x of g, looks up cumsum at the last position of x
+	# in sorted_g, i.e., the cumulative sum over all values <= x. The rows
+	# of a 2-D cumsum are looked up together, so that several cumulative
+	# sums share one search.
 
-	return np.array([deduped_values[x] for x in g])
+	last = np.searchsorted(sorted_g, g, side='right') - 1
+
+	return np.asarray(cumsum)[last]
 
 
 def select_cutoff(g):
@@ -371,10 +638,11 @@ def select_cutoff(g):
 		cutoff = 0
 	else:
 		sorted_g = np.sort(g)
-		cumsum_1 = range(1, len(g)+1)
-		LHS = g * sumlessthan(g, sorted_g, cumsum_1)
+		cumsum_1 = np.arange(1, len(g)+1)
 		cumsum_g = np.cumsum(sorted_g)
-		RHS = 2 * sumlessthan(g, sorted_g, cumsum_g)
+		sums = sumlessthan(g, sorted_g, np.column_stack((cumsum_1, cumsum_g)))
+		LHS = g * sums[:, 0]
+		RHS = 2 * sums[:, 1]
 		gamma = np.max(g[LHS <= RHS])
 		cutoff = 0.5 - np.sqrt(0.25 - 1./gamma)
 
@@ -389,49 +657,74 @@ def split_equal_bins(pscore, blocks):
 	return [0] + centiles + [1]
 
 
-def calc_tstat(sample_c, sample_t):
-
-	N_c = sample_c.shape[0]
-	N_t = sample_t.shape[0]
-	var_c = sample_c.var(ddof=1)
-	var_t = sample_t.var(ddof=1)
-
-	return (sample_t.mean()-sample_c.mean()) / np.sqrt(var_c/N_c+var_t/N_t)
-
-
-def calc_sample_sizes(D):
-
-	N = D.shape[0]
-	mid_index  = N // 2
-	
-	Nleft = mid_index
-	Nleft_t = D[:mid_index].sum()
-	Nleft_c = Nleft - Nleft_t
-
-	Nright = N - Nleft
-	Nright_t = D[mid_index:].sum()
-	Nright_c = Nright - Nright_t
-
-	return (Nleft_c, Nleft_t, Nright_c, Nright_t)
-
-
 def select_blocks(pscore, logodds, D, K, p_low, p_high):
 
-	scope = (pscore >= p_low) & (pscore <= p_high)
-	c, t = (scope & (D==0)), (scope & (D==1))
-
-	Nleft_c, Nleft_t, Nright_c, Nright_t = calc_sample_sizes(D[scope])
-	if min(Nleft_c, Nleft_t, Nright_c, Nright_t) < K+1:
-		return [p_low, p_high]
-
-	tstat = calc_tstat(logodds[c], logodds[t])
-	if tstat <= 1.96:
-		return [p_low, p_high]
-
-	low = pscore[scope][0]
-	mid = pscore[scope][scope.sum() // 2]
-	high = pscore[scope][-1]
-
-	return select_blocks(pscore, logodds, D, K, low, mid) + \
-	       select_blocks(pscore, logodds, D, K, mid, high)
-
+	# Splits [p_low, p_high] into bins by repeatedly halving any bin in
+	# which the log-odds ratio of the treated and controls differ
+	# significantly, as long as every half keeps at least K+1 units of
+	# each group. Returns the bin boundaries as a flat list of (low, high)
+	# pairs, in increasing order. Assumes pscore is sorted.
+	#
+	# Every bin covers a contiguous range of the sorted units, so its
+	# sample sizes and the sums and sums of squares of the log-odds by
+	# group are differences of prefix sums. Bins are processed from an
+	# explicit stack in the same order as a recursive depth-first split.
+
+	def prefix_sum(x):
+		return np.concatenate(([0], np.cumsum(x)))
+
+	centered = logodds - logodds.mean()  # for precision of the squares
+	cum_t = prefix_sum(D)
+	cum_all = prefix_sum(centered)
+	cum_all2 = prefix_sum(centered**2)
+	cum_t1 = prefix_sum(centered*D)
+	cum_t2 = prefix_sum(centered**2*D)
+
+	def bin_range(low, high):
+		return (np.searchsorted(pscore, low, 'left'),
+		        np.searchsorted(pscore, high, 'right'))
+
+	def bin_tstat(a, b):
+		N_t = cum_t[b] - cum_t[a]
+		N_c = (b-a) - N_t
+		sum_t = cum_t1[b] - cum_t1[a]
+		sum_c = (cum_all[b]-cum_all[a]) - sum_t
+		sumsq_t = cum_t2[b] - cum_t2[a]
+		sumsq_c = (cum_all2[b]-cum_all2[a]) - sumsq_t
+		mean_t, mean_c = sum_t/N_t, sum_c/N_c
+		var_t = max(sumsq_t - N_t*mean_t**2, 0) / (N_t-1)
+		var_c = max(sumsq_c - N_c*mean_c**2, 0) / (N_c-1)
+		return (mean_t-mean_c) / np.sqrt(var_c/N_c+var_t/N_t)
+
+	blocks = []
+	stack = [(p_low, p_high)]
+	while stack:
+		low, high = stack.pop()
+		a, b = bin_range(low, high)
+		mid = a + (b-a)//2
+
+		Nleft_t = cum_t[mid] - cum_t[a]
+		Nleft_c = (mid-a) - Nleft_t
+		Nright_t = cum_t[b] - cum_t[mid]
+		Nright_c = (b-mid) - Nright_t
+		if min(Nleft_c, Nleft_t, Nright_c, Nright_t) < K+1:
+			blocks.extend([low, high])
+			continue
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			tstat = bin_tstat(a, b)
+		if tstat <= 1.96:
+			blocks.extend([low, high])
+			continue
+
+		new_low, new_mid, new_high = pscore[a], pscore[mid], pscore[b-1]
+		if (a, b) in (bin_range(new_low, new_mid),
+		              bin_range(new_mid, new_high)):
+			# halving would not shrink the bin, e.g. because of tied
+			# propensity scores, so it can never terminate
+			blocks.extend([low, high])
+			continue
+		stack.append((new_mid, new_high))
+		stack.append((new_low, new_mid))
+
+	return blocks
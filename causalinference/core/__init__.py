@@ -2,4 +2,5 @@ from .data import Dict, Data
 from .summary import Summary
 from .propensity import Propensity, PropensitySelect
 from .strata import Strata
+from .permutation import Permutation
 
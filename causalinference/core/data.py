@@ -41,11 +41,20 @@ class Data(Dict):
 
 	"""
 	Dictionary-like class containing basic data.
+
+	The outcomes and covariates of the control and treated groups
+	(Y_c, Y_t, X_c, and X_t) are split off on first access. When the
+	groups already occupy contiguous rows they are views into Y and X;
+	otherwise the rows are permuted once so that they do.
 	"""
 
-	def __init__(self, outcome, treatment, covariates):
+	splits = ('Y_c', 'Y_t', 'X_c', 'X_t')
+
+	def __init__(self, outcome, treatment, covariates, dtype=None):
 
 		Y, D, X = preprocess(outcome, treatment, covariates)
+		if dtype is not None:
+			X = X.astype(dtype, copy=False)
 		self._dict = dict()
 		self._dict['Y'] = Y
 		self._dict['D'] = D
@@ -53,10 +62,6 @@ class Data(Dict):
 		self._dict['N'], self._dict['K'] = X.shape
 		self._dict['controls'] = (D==0)
 		self._dict['treated'] = (D==1)
-		self._dict['Y_c'] = Y[self._dict['controls']]
-		self._dict['Y_t'] = Y[self._dict['treated']]
-		self._dict['X_c'] = X[self._dict['controls']]
-		self._dict['X_t'] = X[self._dict['treated']]
 		self._dict['N_t'] = D.sum()
 		self._dict['N_c'] = self._dict['N'] - self._dict['N_t']
 		if self._dict['K']+1 > self._dict['N_c']:
@@ -65,6 +70,51 @@ class Data(Dict):
 			raise ValueError('Too few treated units: N_t < K+1')
 
 
+	def __getitem__(self, key):
+
+		if key in self.splits and key not in self._dict:
+			self._split()
+
+		return self._dict[key]
+
+
+	def __iter__(self):
+
+		return iter(self.keys())
+
+
+	def keys(self):
+
+		return list(self._dict.keys()) + \
+		       [key for key in self.splits if key not in self._dict]
+
+
+	def get(self, key, default=None):
+
+		if key in self.splits:
+			return self[key]
+
+		return self._dict.get(key, default)
+
+
+	def _split(self):
+
+		Y, D, X = self._dict['Y'], self._dict['D'], self._dict['X']
+		N, N_c, N_t = self._dict['N'], self._dict['N_c'], self._dict['N_t']
+
+		if not D[:N_c].any():
+			c, t = slice(0, N_c), slice(N_c, N)
+		elif D[:N_t].all():
+			c, t = slice(N_t, N), slice(0, N_t)
+		else:
+			order = np.argsort(D, kind='mergesort')
+			Y, X = Y[order], X[order]
+			c, t = slice(0, N_c), slice(N_c, N)
+
+		self._dict['Y_c'], self._dict['Y_t'] = Y[c], Y[t]
+		self._dict['X_c'], self._dict['X_t'] = X[c], X[t]
+
+
 def preprocess(Y, D, X):
 
 	if Y.shape[0] == D.shape[0] == X.shape[0]:
@@ -0,0 +1,185 @@
+from __future__ import division
+import numpy as np
+
+import causalinference.utils.tools as tools
+from .data import Dict
+
+
+class Permutation(Dict):
+
+	"""
+	Dictionary-like class containing the results of a Fisher
+	randomization test of the sharp null hypothesis of no treatment
+	effect for any unit.
+
+	The treatment indicators are permuted, within groups of units if
+	groups are given, and the test statistic is recomputed for every
+	permutation. Permutations are evaluated in batches, each batch as
+	a matrix whose columns are permuted treatment vectors, so that the
+	statistics of a whole batch follow from a few matrix products.
+	Batches can run concurrently in n_jobs threads. If tol is given,
+	sampling stops once the Monte Carlo standard error of the p-value
+	falls to tol.
+
+	The p-value is two-sided, (1+M)/(1+P), where M is the number of the
+	P permuted statistics at least as large in absolute value as the
+	observed one, up to a relative rounding tolerance of 1e-12, so that
+	permutations that reproduce the observed assignment are counted
+	even though their statistics are computed in a different batch
+	from the observed one. Batch i is drawn from its own random number
+	generator, seeded from seed, and the stopping rule is checked
+	batch by batch in order, so that results do not depend on n_jobs.
+
+	Each batch holds an N x batch matrix of permuted treatment
+	indicators, 8*N*batch bytes, and n_jobs batches are held at once;
+	for large samples, lower batch to bound memory.
+	"""
+
+	def __init__(self, data, statistic='rdiff', P=1000, groups=None,
+	             batch=100, tol=None, n_jobs=1, seed=None, adj=1):
+
+		Y, D, X = data['Y'], data['D'], data['X']
+		if statistic == 'rdiff':
+			stat = lambda Dmat: calc_rdiff(Y, Dmat)
+		elif statistic == 'ols':
+			prep = prepare_ols(Y, X, adj)
+			stat = lambda Dmat: calc_ols_ate(prep, Dmat)
+		else:
+			raise ValueError('Invalid statistic.')
+		if groups is None:
+			groups = np.zeros(D.shape[0], dtype=int)
+
+		observed = stat(D[:, None].astype(float))[0]
+		threshold = np.abs(observed) * (1-1e-12)
+		n_batches = -(-P // batch)  # ceiling division
+		rng = np.random.RandomState(seed)
+		seeds = rng.randint(2**31-1, size=n_batches)
+		sizes = [min(batch, P - i*batch) for i in range(n_batches)]
+		run = lambda i: stat(permute(D, groups, sizes[i],
+		                             np.random.RandomState(seeds[i])))
+
+		null, exceed, n, done = [], 0, 0, False
+		n_workers = tools.n_workers(n_jobs)
+		for start in range(0, n_batches, n_workers):
+			batches = list(range(start, min(start+n_workers, n_batches)))
+			for stats in tools.parallel_map(run, batches, n_jobs):
+				null.append(stats)
+				n += stats.shape[0]
+				exceed += (np.abs(stats) >= threshold).sum()
+				p_value = (1+exceed) / (1+n)
+				if tol is not None and calc_mc_se(p_value, n) <= tol:
+					done = True
+					break
+			if done:
+				break
+
+		self._dict = dict()
+		self._dict['statistic'] = statistic
+		self._dict['observed'] = observed
+		self._dict['null'] = np.concatenate(null)
+		self._dict['P'] = n
+		self._dict['p_value'] = p_value
+		self._dict['p_value_se'] = calc_mc_se(p_value, n)
+
+
+	def __str__(self):
+
+		table_width = 80
+
+		output = '\n'
+		output += 'Randomization Test of No Effect: '
+		output += self['statistic'].upper() + '\n\n'
+
+		entries1 = ['Observed', 'Permutations', 'P-value', 'S.e.']
+		entry_types1 = ['string']*4
+		col_spans1 = [1]*4
+		output += tools.add_row(entries1, entry_types1,
+		                        col_spans1, table_width)
+		output += tools.add_line(table_width)
+
+		entries2 = [self['observed'], self['P'], self['p_value'],
+		            self['p_value_se']]
+		entry_types2 = ['float', 'integer', 'float', 'float']
+		output += tools.add_row(entries2, entry_types2,
+		                        col_spans1, table_width)
+
+		return output
+
+
+def permute(D, groups, size, rng):
+
+	# N x size matrix whose columns are permutations of D within groups.
+	# Sorting random keys offset by group number orders the units of
+	# each group randomly while keeping the groups in place. Columns are
+	# drawn one at a time, so that the only N x size array is the
+	# result.
+
+	N = D.shape[0]
+	base = np.argsort(groups, kind='mergesort')
+	Dmat = np.empty((N, size))
+	for j in range(size):
+		keys = groups[base] + rng.uniform(size=N)
+		Dmat[base, j] = D[base[np.argsort(keys)]]
+
+	return Dmat
+
+
+def calc_rdiff(Y, Dmat):
+
+	# Difference in mean outcomes between treated and controls, for each
+	# column of treatment indicators.
+
+	N_t = Dmat.sum(0)
+	sum_t = Y.dot(Dmat)
+
+	return sum_t/N_t - (Y.sum()-sum_t)/(Y.shape[0]-N_t)
+
+
+def prepare_ols(Y, X, adj):
+
+	# Parts of the OLS fit that do not depend on D. By Frisch-Waugh-
+	# Lovell, the treatment coefficient follows from partialling out
+	# the fixed regressors A = [1, X-mean(X)] (just the intercept if
+	# adj = 0), whose Gram matrix and coefficients on Y are computed
+	# here once.
+
+	N = X.shape[0]
+	if adj == 0:
+		A = np.ones((N, 1))
+	else:
+		dX = X - X.mean(0, dtype=np.float64)
+		A = np.column_stack((np.ones(N), dX))
+	AA_inv = np.linalg.inv(A.T.dot(A))
+	coef = AA_inv.dot(A.T.dot(Y))
+
+	return (Y, A, AA_inv, coef, adj)
+
+
+def calc_ols_ate(prep, Dmat):
+
+	# OLS estimate of the average treatment effect for each column d of
+	# Dmat. The regressors that vary with D are W = d (adj <= 1) or
+	# W = diag(d)A (adj = 2). Since d is binary, W'W = d'd = 1'd or
+	# W'W = W'A = A'diag(d)A. The partialled normal equations
+	# (W'W - W'A inv(A'A) A'W) b = W'Y - W'A coef are then solved for
+	# all columns at once; the first entry of b is the effect of D.
+
+	Y, A, AA_inv, coef, adj = prep
+	if adj <= 1:
+		WA = Dmat.T.dot(A)
+		WW = Dmat.sum(0)
+		WY = Y.dot(Dmat)
+		lhs = WW - np.einsum('bp,pq,bq->b', WA, AA_inv, WA)
+		rhs = WY - WA.dot(coef)
+		return rhs / lhs
+	else:
+		G = tools.sum_outer(Dmat, A)
+		WY = (A*Y[:, None]).T.dot(Dmat).T
+		lhs = G - np.einsum('bpr,rs,bsq->bpq', G, AA_inv, G)
+		rhs = WY - G.dot(coef)
+		return np.linalg.solve(lhs, rhs[..., None])[:, 0, 0]
+
+
+def calc_mc_se(p_value, P):
+
+	return np.sqrt(p_value*(1-p_value)/P)
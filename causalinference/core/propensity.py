@@ -1,7 +1,11 @@
 from __future__ import division
 import numpy as np
+import scipy.linalg
+import threading
+import warnings
 from scipy.optimize import fmin_bfgs
-from itertools import combinations_with_replacement
+from itertools import chain, combinations_with_replacement
+from collections import OrderedDict
 
 import causalinference.utils.tools as tools
 from .data import Dict
@@ -18,19 +22,22 @@ class Propensity(Dict):
 	logistic regression.
 	"""
 
-	def __init__(self, data, lin, qua):
+	def __init__(self, data, lin, qua, solver='newton'):
 
 		Z = form_matrix(data['X'], lin, qua)
 		Z_c, Z_t = Z[data['controls']], Z[data['treated']]
-		beta = calc_coef(Z_c, Z_t)
+		beta, H_chol = fit_logit(Z_c, Z_t, solver)
 
 		self._data = data
 		self._dict = dict()
 		self._dict['lin'], self._dict['qua'] = lin, qua
 		self._dict['coef'] = beta
 		self._dict['loglike'] = -neg_loglike(beta, Z_c, Z_t)
-		self._dict['fitted'] = sigmoid(Z.dot(beta))
-		self._dict['se'] = calc_se(Z, self._dict['fitted'])
+		self._dict['fitted'] = sigmoid(index(Z, beta))
+		if H_chol is None:
+			self._dict['se'] = calc_se(Z, self._dict['fitted'])
+		else:
+			self._dict['se'] = calc_se_chol(H_chol)
 
 
 	def __str__(self):
@@ -87,20 +94,92 @@ class PropensitySelect(Propensity):
 	logistic regression.
 	"""
 
-	def __init__(self, data, lin_B, C_lin, C_qua):
+	def __init__(self, data, lin_B, C_lin, C_qua, solver='newton',
+	             n_jobs=1):
 
 		X_c, X_t = data['X_c'], data['X_t']
-		lin = select_lin_terms(X_c, X_t, lin_B, C_lin)
-		qua = select_qua_terms(X_c, X_t, lin, C_qua)
+		lin = select_lin_terms(X_c, X_t, lin_B, C_lin, solver, n_jobs)
+		qua = select_qua_terms(X_c, X_t, lin, C_qua, solver, n_jobs)
 
-		super(PropensitySelect, self).__init__(data, lin, qua)
+		super(PropensitySelect, self).__init__(data, lin, qua, solver)
+
+
+class ColumnCache(object):
+
+	"""
+	Least-recently-used cache of the columns of a propensity score design
+	matrix, keyed by term: a column number of X for a linear term, or a
+	tuple of two column numbers for a quadratic term. Columns are stored
+	in a preallocated column-major buffer of at most max_mem bytes.
+	"""
+
+	def __init__(self, X, max_mem=2**27):
+
+		N, K = X.shape
+		terms = K + K*(K+1)//2
+		dtype = design_dtype(X)
+		capacity = max(1, min(terms, max_mem // (dtype.itemsize*N)))
+
+		self._X = X
+		self._buffer = np.empty((N, capacity), dtype, order='F')
+		self._slots = OrderedDict()
+		self._lock = threading.Lock()
+
+
+	def fill(self, term, out):
+
+		"""
+		Copies the column corresponding to term into out.
+		"""
+
+		with self._lock:
+			out[:] = self._column(term)
+
+
+	def _column(self, term):
+
+		if term in self._slots:
+			slot = self._slots.pop(term)
+			self._slots[term] = slot  # mark as most recently used
+			return self._buffer[:, slot]
+
+		if len(self._slots) < self._buffer.shape[1]:
+			slot = len(self._slots)
+		else:  # evict least recently used
+			slot = self._slots.popitem(last=False)[1]
+
+		column = self._buffer[:, slot]
+		if isinstance(term, tuple):
+			np.multiply(self._X[:, term[0]], self._X[:, term[1]],
+			            out=column)
+		else:
+			column[:] = self._X[:, term]
+		self._slots[term] = slot
+
+		return column
+
+
+def form_matrix_cached(cache, lin, qua, extra=0):
+
+	# Same as form_matrix, but in column-major order, with columns taken
+	# from a ColumnCache and extra trailing columns left unfilled.
+
+	terms = list(lin) + list(qua)
+	N = cache._X.shape[0]
+
+	mat = np.empty((N, 1+len(terms)+extra), cache._buffer.dtype, order='F')
+	mat[:, 0] = 1  # constant term
+	for col, term in enumerate(terms, 1):
+		cache.fill(term, mat[:, col])
+
+	return mat
 
 
 def form_matrix(X, lin, qua):
 
 	N, K = X.shape
 
-	mat = np.empty((N, 1+len(lin)+len(qua)))
+	mat = np.empty((N, 1+len(lin)+len(qua)), design_dtype(X))
 	mat[:, 0] = 1  # constant term
 
 	current_col = 1
@@ -114,6 +193,64 @@ def form_matrix(X, lin, qua):
 	return mat
 
 
+def design_dtype(X):
+
+	# Design matrices are kept in single precision when the covariates
+	# are, and in double precision otherwise.
+
+	return np.promote_types(X.dtype, np.float32)
+
+
+def index(X, beta, block_rows=2**14):
+
+	# Linear index X.dot(beta) in double precision. Single-precision X
+	# is converted a block of rows at a time, so that it is never copied
+	# to double as a whole, while the likelihood compared in the line
+	# search of newton stays accurate to double precision.
+
+	if X.dtype != np.float32:
+		return X.dot(beta)
+
+	out = np.empty(X.shape[0])
+	for start in range(0, X.shape[0], block_rows):
+		X_b = X[start:start+block_rows].astype(np.float64)
+		out[start:start+block_rows] = X_b.dot(beta)
+
+	return out
+
+
+def tdot(X, v, block_rows=2**14):
+
+	# X'v. For single-precision X each block of rows is multiplied in
+	# single precision and the blocks are summed in double precision.
+
+	if X.dtype != np.float32:
+		return X.T.dot(v)
+
+	out = np.zeros(X.shape[1])
+	for start in range(0, X.shape[0], block_rows):
+		X_b = X[start:start+block_rows]
+		out += X_b.T.dot(v[start:start+block_rows].astype(X.dtype))
+
+	return out
+
+
+def weighted_gram(X, w, block_rows=2**14):
+
+	# X'diag(w)X, accumulated over blocks of rows like tdot.
+
+	if X.dtype != np.float32:
+		return np.dot(w*X.T, X)
+
+	out = np.zeros((X.shape[1], X.shape[1]))
+	for start in range(0, X.shape[0], block_rows):
+		X_b = X[start:start+block_rows]
+		w_b = w[start:start+block_rows].astype(X.dtype)
+		out += np.dot(w_b*X_b.T, X_b)
+
+	return out
+
+
 def sigmoid(x, top_threshold=100, bottom_threshold=-100):
 
 	high_x = (x >= top_threshold)
@@ -144,35 +281,122 @@ def log1exp(x, top_threshold=100, bottom_threshold=-100):
 
 def neg_loglike(beta, X_c, X_t):
 
-	return log1exp(X_t.dot(beta)).sum() + log1exp(-X_c.dot(beta)).sum()
+	return log1exp(index(X_t, beta)).sum() + \
+	       log1exp(-index(X_c, beta)).sum()
 
 
 def neg_gradient(beta, X_c, X_t):
 
-	return (sigmoid(X_c.dot(beta))*X_c.T).sum(1) - \
-	       (sigmoid(-X_t.dot(beta))*X_t.T).sum(1)
-
-
-def calc_coef(X_c, X_t):
-
-	K = X_c.shape[1]
+	return tdot(X_c, sigmoid(index(X_c, beta))) - \
+	       tdot(X_t, sigmoid(-index(X_t, beta)))
+
+
+def newton(X_c, X_t, beta=None, tol=1e-10, maxiter=100):
+
+	# Maximizes the logit likelihood by Newton-Raphson (equivalently,
+	# IRLS), starting from beta (zero by default). Each iteration
+	# evaluates the linear index once, forms the analytic gradient and
+	# Hessian from it, and solves for the step through the Cholesky
+	# factor of the Hessian. Steps are halved until the likelihood does
+	# not decrease; if no step down to 1e-8 of the full one achieves
+	# that, the current coefficients are kept. Iterations also stop once
+	# the likelihood changes by no more than its rounding error, which
+	# with single-precision covariates happens before the step falls
+	# below tol. Returns the coefficients and the Cholesky factor of the
+	# Hessian at those coefficients, so that standard errors need no
+	# further factoring. Warns if the iterations run out before
+	# convergence. Raises LinAlgError if the Hessian is singular, e.g.
+	# under perfect separation.
+
+	if beta is None:
+		beta = np.zeros(X_c.shape[1])
+	xb_c, xb_t = index(X_c, beta), index(X_t, beta)
+	neg_ll = log1exp(xb_t).sum() + log1exp(-xb_c).sum()
+
+	converged = False
+	for i in range(maxiter+1):
+		p_c, p_t = sigmoid(xb_c), sigmoid(xb_t)
+		grad = tdot(X_c, p_c) - tdot(X_t, 1-p_t)
+		H = weighted_gram(X_c, p_c*(1-p_c)) + \
+		    weighted_gram(X_t, p_t*(1-p_t))
+		H_chol = scipy.linalg.cho_factor(H)
+		step = scipy.linalg.cho_solve(H_chol, grad)
+		if converged or np.abs(step).max() < tol:
+			break
+		if i == maxiter:
+			warnings.warn('Newton-Raphson did not converge in ' +
+			              str(maxiter) + ' iterations.', RuntimeWarning)
+			break
+
+		t = 1.0
+		while t >= 1e-8:
+			beta_new = beta - t*step
+			xb_c_new = index(X_c, beta_new)
+			xb_t_new = index(X_t, beta_new)
+			neg_ll_new = log1exp(xb_t_new).sum() + \
+			             log1exp(-xb_c_new).sum()
+			if neg_ll_new <= neg_ll:
+				break
+			t /= 2
+		else:
+			break  # no descent step; the Hessian is already at beta
+		converged = neg_ll - neg_ll_new <= 1e-14*abs(neg_ll)
+		beta, xb_c, xb_t = beta_new, xb_c_new, xb_t_new
+		neg_ll = neg_ll_new
+
+	return beta, H_chol
+
+
+def fit_logit(X_c, X_t, solver='newton', beta0=None):
+
+	# Returns the logit coefficients and, when they were computed by
+	# Newton-Raphson, the Cholesky factor of the Hessian (None under
+	# BFGS). The optimization starts from beta0, or from zero if it is
+	# not given. Solver 'newton' falls back to BFGS if the Hessian turns
+	# out to be singular.
+
+	if beta0 is None:
+		beta0 = np.zeros(X_c.shape[1])
+
+	if solver == 'newton':
+		try:
+			return newton(X_c, X_t, beta0)
+		except np.linalg.LinAlgError:
+			pass
+	elif solver != 'bfgs':
+		raise ValueError('Invalid solver.')
 
 	neg_ll = lambda b: neg_loglike(b, X_c, X_t)
 	neg_grad = lambda b: neg_gradient(b, X_c, X_t)
 
-	logit = fmin_bfgs(neg_ll, np.zeros(K), neg_grad,
+	logit = fmin_bfgs(neg_ll, beta0, neg_grad,
 			  full_output=True, disp=False)
 
-	return logit[0]
+	return logit[0], None
+
+
+def calc_coef(X_c, X_t, solver='newton', beta0=None):
+
+	return fit_logit(X_c, X_t, solver, beta0)[0]
 
 
 def calc_se(X, phat):
 
-	H = np.dot(phat*(1-phat)*X.T, X)
+	H = weighted_gram(X, phat*(1-phat))
 	
 	return np.sqrt(np.diag(np.linalg.inv(H)))
 
 
+def calc_se_chol(H_chol):
+
+	# Same as calc_se, given the Cholesky factor of the Hessian.
+
+	K = H_chol[0].shape[0]
+	H_inv = scipy.linalg.cho_solve(H_chol, np.identity(K))
+
+	return np.sqrt(np.diag(H_inv))
+
+
 def get_excluded_lin(K, included):
 
 	included_set = set(included)
@@ -188,16 +412,54 @@ def get_excluded_qua(lin, included):
 	return [x for x in whole_set if x not in included_set]
 
 
-def calc_loglike(X_c, X_t, lin, qua):
+def calc_loglike(X_c, X_t, lin, qua, solver='newton'):
 
 	Z_c = form_matrix(X_c, lin, qua)
 	Z_t = form_matrix(X_t, lin, qua)
-	beta = calc_coef(Z_c, Z_t)
+	beta = calc_coef(Z_c, Z_t, solver)
 
 	return -neg_loglike(beta, Z_c, Z_t)
 
 
-def select_lin(X_c, X_t, lin_B, C_lin):
+def calc_lr_stats(caches, lin, qua, candidates, solver='newton', n_jobs=1):
+
+	# Computes the likelihood ratio statistic of every candidate term
+	# against the model containing terms lin and qua. Each candidate
+	# model is the null design plus one column at the end, so every
+	# worker assembles the null design once from the column caches and
+	# then copies each candidate column into the last slot. Candidate
+	# fits are warm-started from the null coefficients padded with a
+	# zero.
+
+	cache_c, cache_t = caches
+	Z_c = form_matrix_cached(cache_c, lin, qua)
+	Z_t = form_matrix_cached(cache_t, lin, qua)
+	beta_null = calc_coef(Z_c, Z_t, solver)
+	ll_null = -neg_loglike(beta_null, Z_c, Z_t)
+	beta0 = np.append(beta_null, 0)
+
+	def lr_stats_part(terms):
+		Z_c = form_matrix_cached(cache_c, lin, qua, extra=1)
+		Z_t = form_matrix_cached(cache_t, lin, qua, extra=1)
+		lr_stats = []
+		for term in terms:
+			cache_c.fill(term, Z_c[:, -1])
+			cache_t.fill(term, Z_t[:, -1])
+			beta = calc_coef(Z_c, Z_t, solver, beta0)
+			ll_alt = -neg_loglike(beta, Z_c, Z_t)
+			lr_stats.append(2 * (ll_alt - ll_null))
+		return lr_stats
+
+	n_parts = min(tools.n_workers(n_jobs), len(candidates))
+	bounds = np.linspace(0, len(candidates), n_parts+1).astype(int)
+	parts = [candidates[a:b] for a, b in zip(bounds, bounds[1:])]
+	results = tools.parallel_map(lr_stats_part, parts, n_jobs)
+
+	return np.array(list(chain.from_iterable(results)))
+
+
+def select_lin(X_c, X_t, lin_B, C_lin, solver='newton', n_jobs=1,
+               caches=None):
 
 	# Selects, through a sequence of likelihood ratio tests, the
 	# variables that should be included linearly in propensity
@@ -208,23 +470,20 @@ def select_lin(X_c, X_t, lin_B, C_lin):
 	if excluded == []:
 		return lin_B
 
-	ll_null = calc_loglike(X_c, X_t, lin_B, [])
-
-	def lr_stat_lin(lin_term):
-		ll_alt = calc_loglike(X_c, X_t, lin_B+[lin_term], [])
-		return 2 * (ll_alt - ll_null)
-
-	lr_stats = np.array([lr_stat_lin(term) for term in excluded])
+	if caches is None:
+		caches = (ColumnCache(X_c), ColumnCache(X_t))
+	lr_stats = calc_lr_stats(caches, lin_B, [], excluded, solver, n_jobs)
 	argmax_lr = lr_stats.argmax()
 
 	if lr_stats[argmax_lr] < C_lin:
 		return lin_B
 	else:
 		new_term = [excluded[argmax_lr]]
-		return select_lin(X_c, X_t, lin_B+new_term, C_lin)
+		return select_lin(X_c, X_t, lin_B+new_term, C_lin, solver,
+		                  n_jobs, caches)
 
 
-def select_lin_terms(X_c, X_t, lin_B, C_lin):
+def select_lin_terms(X_c, X_t, lin_B, C_lin, solver='newton', n_jobs=1):
 
 	# Mostly a wrapper around function select_lin to handle cases that
 	# require little computation.
@@ -235,10 +494,11 @@ def select_lin_terms(X_c, X_t, lin_B, C_lin):
 	elif C_lin == np.inf:
 		return lin_B
 	else:
-		return select_lin(X_c, X_t, lin_B, C_lin)
+		return select_lin(X_c, X_t, lin_B, C_lin, solver, n_jobs)
 
 
-def select_qua(X_c, X_t, lin, qua_B, C_qua):
+def select_qua(X_c, X_t, lin, qua_B, C_qua, solver='newton', n_jobs=1,
+               caches=None):
 
 	# Selects, through a sequence of likelihood ratio tests, the
 	# variables that should be included quadratically in propensity
@@ -248,23 +508,20 @@ def select_qua(X_c, X_t, lin, qua_B, C_qua):
 	if excluded == []:
 		return qua_B
 
-	ll_null = calc_loglike(X_c, X_t, lin, qua_B)
-
-	def lr_stat_qua(qua_term):
-		ll_alt = calc_loglike(X_c, X_t, lin, qua_B+[qua_term])
-		return 2 * (ll_alt - ll_null)
-
-	lr_stats = np.array([lr_stat_qua(term) for term in excluded])
+	if caches is None:
+		caches = (ColumnCache(X_c), ColumnCache(X_t))
+	lr_stats = calc_lr_stats(caches, lin, qua_B, excluded, solver, n_jobs)
 	argmax_lr = lr_stats.argmax()
 
 	if lr_stats[argmax_lr] < C_qua:
 		return qua_B
 	else:
 		new_term = [excluded[argmax_lr]]
-		return select_qua(X_c, X_t, lin, qua_B+new_term, C_qua)
+		return select_qua(X_c, X_t, lin, qua_B+new_term, C_qua,
+		                  solver, n_jobs, caches)
 
 
-def select_qua_terms(X_c, X_t, lin, C_qua):
+def select_qua_terms(X_c, X_t, lin, C_qua, solver='newton', n_jobs=1):
 
 	# Mostly a wrapper around function select_qua to handle cases that
 	# require little computation.
@@ -276,5 +533,5 @@ def select_qua_terms(X_c, X_t, lin, C_qua):
 	elif C_qua == np.inf:
 		return []
 	else:
-		return select_qua(X_c, X_t, lin, [], C_qua)
+		return select_qua(X_c, X_t, lin, [], C_qua, solver, n_jobs)
 
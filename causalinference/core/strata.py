@@ -1,3 +1,5 @@
+import numpy as np
+
 import causalinference.utils.tools as tools
 
 
@@ -5,20 +7,98 @@ class Strata(object):
 
 	"""
 	List-like object containing the stratified propensity bins.
+
+	Units are sorted once, by bin and then by treatment status, so that
+	every stratum occupies a contiguous slice of the sorted data. The
+	CausalModel instance of a stratum is built from views of its slice
+	the first time the stratum is accessed.
 	"""
 
-	def __init__(self, strata, subsets, pscore):
+	def __init__(self, data, blocks):
+
+		# bins are half-open intervals (blocks[j], blocks[j+1]]
+		pscore, D = data['pscore'], data['D']
+		bins = np.searchsorted(blocks, pscore, side='left') - 1
+		n_bins = len(blocks) - 1
+		binned = np.flatnonzero((bins >= 0) & (bins < n_bins))
+		order = binned[np.lexsort((D[binned], bins[binned]))]
+
+		counts = np.bincount(bins[order], minlength=n_bins)
+		counts_t = np.bincount(bins[order], weights=D[order],
+		                       minlength=n_bins)
+		if (data['K']+1 > counts-counts_t).any():
+			raise ValueError('Too few control units: N_c < K+1')
+		if (data['K']+1 > counts_t).any():
+			raise ValueError('Too few treated units: N_t < K+1')
+
+		self._Y, self._D = data['Y'][order], D[order]
+		self._X, self._pscore = data['X'][order], pscore[order]
+		self._bounds = np.concatenate(([0], np.cumsum(counts)))
+		self._strata = [None] * n_bins
+		self._estimates = [dict() for i in range(n_bins)]
+		self._order, self._N = order, data['N']
+
+
+	def _build(self, index):
+
+		from ..causal import CausalModel  # avoids circular import
+
+		start, end = self._bounds[index], self._bounds[index+1]
+		stratum = CausalModel(self._Y[start:end], self._D[start:end],
+		                      self._X[start:end])
+		pscore_sub = self._pscore[start:end]
+		stratum.raw_data._dict['pscore'] = pscore_sub
+		D_sub = stratum.raw_data['D']
+		pscore_sub_c = pscore_sub[D_sub==0]
+		pscore_sub_t = pscore_sub[D_sub==1]
+		stratum.summary_stats._summarize_pscore(pscore_sub_c,
+		                                        pscore_sub_t)
+		for (key, estimate) in self._estimates[index].items():
+			stratum.estimates[key] = estimate
+
+		return stratum
+
+
+	def attach(self, key, estimates):
+
+		"""
+		Stores one estimate per stratum under key in the estimates of
+		the stratum models, right away for the strata already built
+		and otherwise when they are built.
+		"""
+
+		for (index, estimate) in enumerate(estimates):
+			self._estimates[index][key] = estimate
+			if self._strata[index] is not None:
+				self._strata[index].estimates[key] = estimate
+
+
+	def labels(self):
+
+		"""
+		Returns the stratum number of every unit, in the original order
+		of the data, with -1 for units outside all strata.
+		"""
+
+		labels = np.repeat(-1, self._N)
+		labels[self._order] = np.repeat(np.arange(len(self)),
+		                                np.diff(self._bounds))
+
+		return labels
+
+
+	def segments(self):
+
+		"""
+		Returns a list of the (Y, D, X) of every stratum, as views into
+		the sorted data, without building the stratum models.
+		"""
+
+		bounds = zip(self._bounds[:-1], self._bounds[1:])
+
+		return [(self._Y[start:end], self._D[start:end],
+		         self._X[start:end]) for (start, end) in bounds]
 
-		self._strata = strata
-		for stratum, subset in zip(self._strata, subsets):
-			pscore_sub = pscore[subset]
-			stratum.raw_data._dict['pscore'] = pscore_sub
-			D_sub = stratum.raw_data['D']
-			pscore_sub_c = pscore_sub[D_sub==0]
-			pscore_sub_t = pscore_sub[D_sub==1]
-			stratum.summary_stats._summarize_pscore(pscore_sub_c,
-			                                        pscore_sub_t)
-			
 
 	def __len__(self):
 
@@ -27,6 +107,12 @@ class Strata(object):
 
 	def __getitem__(self, index):
 
+		if isinstance(index, slice):
+			return [self[i] for i in range(len(self))[index]]
+		index = range(len(self))[index]  # normalizes negative indices
+		if self._strata[index] is None:
+			self._strata[index] = self._build(index)
+
 		return self._strata[index]
 
 
@@ -52,7 +138,7 @@ class Strata(object):
 		                        col_spans2, table_width)
 		output += tools.add_line(table_width)
 
-		strata = self._strata
+		strata = self
 		entry_types3 = ['integer', 'float', 'float', 'integer',
 		                'integer', 'float', 'float', 'float']
 		for i in range(len(strata)):
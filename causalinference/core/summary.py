@@ -27,10 +27,14 @@ class Summary(Dict):
 		self._dict['Y_c_sd'] = np.sqrt(data['Y_c'].var(ddof=1))
 		self._dict['Y_t_sd'] = np.sqrt(data['Y_t'].var(ddof=1))
 		self._dict['rdiff'] = self['Y_t_mean'] - self['Y_c_mean']
-		self._dict['X_c_mean'] = data['X_c'].mean(0)
-		self._dict['X_t_mean'] = data['X_t'].mean(0)
-		self._dict['X_c_sd'] = np.sqrt(data['X_c'].var(0, ddof=1))
-		self._dict['X_t_sd'] = np.sqrt(data['X_t'].var(0, ddof=1))
+		# accumulate in double precision even if X is stored in single
+		X_c, X_t = data['X_c'], data['X_t']
+		self._dict['X_c_mean'] = X_c.mean(0, dtype=np.float64)
+		self._dict['X_t_mean'] = X_t.mean(0, dtype=np.float64)
+		var_c = X_c.var(0, ddof=1, dtype=np.float64)
+		var_t = X_t.var(0, ddof=1, dtype=np.float64)
+		self._dict['X_c_sd'] = np.sqrt(var_c)
+		self._dict['X_t_sd'] = np.sqrt(var_t)
 		self._dict['ndiff'] = calc_ndiff(self['X_c_mean'],
 		                                 self['X_t_mean'],
 						 self['X_c_sd'],
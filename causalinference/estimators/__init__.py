@@ -1,6 +1,7 @@
 from .base import Estimators
-from .ols import OLS
+from .ols import OLS, ChunkedOLS
 from .blocking import Blocking
-from .weighting import Weighting
+from .weighting import Weighting, ChunkedWeighting
 from .matching import Matching
-
+from .bootstrap import Bootstrap
+from .sweep import Sweep
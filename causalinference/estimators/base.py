@@ -1,3 +1,5 @@
+import numpy as np
+
 import causalinference.utils.tools as tools
 from ..core import Dict
 
@@ -30,9 +32,15 @@ class Estimator(Dict):
 		entry_types2 = ['string'] + ['float']*6
 		col_spans2 = [1]*7
 		for (name, coef, se) in zip(names, coefs, ses):
-			entries2 = tools.gen_reg_entries(name.upper(), coef, se)
-			output += tools.add_row(entries2, entry_types2,
-			                        col_spans2, table_width)
+			if np.ndim(coef) == 0:
+				rows = [(name.upper(), coef, se)]
+			else:  # one row per outcome
+				rows = [(name.upper()+'['+str(j)+']', coef_j, se_j)
+				        for j, (coef_j, se_j) in enumerate(zip(coef, se))]
+			for row in rows:
+				entries2 = tools.gen_reg_entries(*row)
+				output += tools.add_row(entries2, entry_types2,
+				                        col_spans2, table_width)
 
 		return output
 
@@ -2,34 +2,52 @@ from __future__ import division
 import numpy as np
 
 from .base import Estimator
+from .ols import OLS
+from ..core import Data
+import causalinference.utils.tools as tools
 
 
 class Blocking(Estimator):
 
 	"""
 	Dictionary-like class containing treatment effect estimates.
+
+	The within-stratum regressions are fitted directly on the (Y, D, X)
+	of each stratum, without building the per-stratum CausalModel
+	instances, and can run concurrently in n_jobs threads. Each
+	regression is kept as the 'ols' estimate of its stratum.
 	"""
 
-	def __init__(self, strata, adj):
-	
+	def __init__(self, strata, adj, n_jobs=1):
+
 		self._method = 'Blocking'
-		for s in strata:
-			s.est_via_ols(adj)
+		if hasattr(strata, 'segments'):
+			segments = strata.segments()
+		else:
+			segments = [(s.raw_data['Y'], s.raw_data['D'],
+			             s.raw_data['X']) for s in strata]
+		fit = lambda segment: fit_stratum(segment, adj)
+		fits = tools.parallel_map(fit, segments, n_jobs)
+		if hasattr(strata, 'attach'):
+			strata.attach('ols', [ols for (data, ols) in fits])
+		else:
+			for (s, (data, ols)) in zip(strata, fits):
+				s.estimates['ols'] = ols
 
-		Ns = [s.raw_data['N'] for s in strata]
-		N_cs = [s.raw_data['N_c'] for s in strata]
-		N_ts = [s.raw_data['N_t'] for s in strata]
+		Ns = [data['N'] for (data, ols) in fits]
+		N_cs = [data['N_c'] for (data, ols) in fits]
+		N_ts = [data['N_t'] for (data, ols) in fits]
 
-		ates = [s.estimates['ols']['ate'] for s in strata]
-		ate_ses = [s.estimates['ols']['ate_se'] for s in strata]
+		ates = [ols['ate'] for (data, ols) in fits]
+		ate_ses = [ols['ate_se'] for (data, ols) in fits]
 		if adj <= 1:
 			atcs, atts = ates, ates
 			atc_ses, att_ses = ate_ses, ate_ses
 		else:
-			atcs = [s.estimates['ols']['atc'] for s in strata]
-			atts = [s.estimates['ols']['att'] for s in strata]
-			atc_ses = [s.estimates['ols']['atc_se'] for s in strata]
-			att_ses = [s.estimates['ols']['att_se'] for s in strata]
+			atcs = [ols['atc'] for (data, ols) in fits]
+			atts = [ols['att'] for (data, ols) in fits]
+			atc_ses = [ols['atc_se'] for (data, ols) in fits]
+			att_ses = [ols['att_se'] for (data, ols) in fits]
 
 		self._dict = dict()
 		self._dict['ate'] = calc_atx(ates, Ns)
@@ -41,6 +59,16 @@ class Blocking(Estimator):
 		self._dict['att_se'] = calc_atx_se(att_ses, N_ts)
 
 
+def fit_stratum(segment, adj):
+
+	# Within-stratum regression. Strata are sorted by treatment status,
+	# so the group splits of the stratum data are views.
+
+	data = Data(*segment)
+
+	return (data, OLS(data, adj))
+
+
 def calc_atx(atxs, Ns):
 
 	N = sum(Ns)
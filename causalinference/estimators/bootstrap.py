@@ -0,0 +1,171 @@
+from __future__ import division
+import numpy as np
+
+from .base import Estimator
+from .ols import form_matrix, calc_coef, calc_ate, calc_atx
+from .weighting import calc_weights, weigh_data
+from .blocking import calc_atx as combine_atx
+from .matching import Matching
+from ..core import Data
+import causalinference.utils.tools as tools
+
+
+class Bootstrap(Estimator):
+
+	"""
+	Dictionary-like class containing treatment effect estimates and
+	their bootstrap standard errors.
+
+	Resamples are drawn with replacement within cells of units that the
+	estimator needs to keep populated: the control and treated groups,
+	or, for blocking, the control and treated units of every stratum.
+	Where the estimator allows it (OLS, weighting, and blocking), a
+	resample is represented by a vector of multinomial counts that
+	enters the fit as frequency weights, rather than by a copy of the
+	data. The propensity score and the strata are held fixed at their
+	full-sample values.
+
+	Replicate i is drawn from its own random number generator, seeded
+	from seed, so that results do not depend on n_jobs. The replicate
+	estimates are kept under the keys ate_reps, atc_reps, and att_reps.
+
+	The bootstrap is not valid for matching estimators with a fixed
+	number of matches [1]_; it is offered for them only as a rough
+	comparison with the analytic standard errors.
+
+	References
+	----------
+	.. [1] Abadie, A. & Imbens, G. (2008). On the Failure of the
+		Bootstrap for Matching Estimators. Econometrica, 76,
+		1537-1557.
+	"""
+
+	def __init__(self, data, estimator, B, n_jobs=1, seed=None,
+	             strata=None, **kwargs):
+
+		if estimator == 'ols':
+			self._method = 'Bootstrap OLS'
+			arrays = (data['Y'], data['D'], data['X'])
+			adj = kwargs.get('adj', 2)
+			stat = lambda w: ols_stat(arrays, adj, w)
+			cells = data['D']
+		elif estimator == 'weighting':
+			self._method = 'Bootstrap Weighting'
+			arrays = (data['Y'], data['D'], data['X'], data['pscore'])
+			stat = lambda w: weighting_stat(arrays, w)
+			cells = data['D']
+		elif estimator == 'blocking':
+			self._method = 'Bootstrap Blocking'
+			segments = strata.segments()
+			adj = kwargs.get('adj', 1)
+			stat = lambda w: blocking_stat(segments, adj, w)
+			cells = np.concatenate([2*j + segment[1] for (j, segment)
+			                        in enumerate(segments)])
+		elif estimator == 'matching':
+			self._method = 'Bootstrap Matching'
+			arrays = (data['Y'], data['D'], data['X'])
+			stat = lambda w: matching_stat(arrays, w, **kwargs)
+			cells = data['D']
+		else:
+			raise ValueError('Invalid estimator.')
+
+		seeds = np.random.RandomState(seed).randint(2**31-1, size=B)
+		draw = lambda s: stat(resample(cells, np.random.RandomState(s)))
+		reps = tools.parallel_map(draw, list(seeds), n_jobs)
+
+		self._dict = stat(np.ones(len(cells)))
+		for name in list(self._dict.keys()):
+			self._dict[name+'_reps'] = np.array([rep[name] for rep in reps])
+			self._dict[name+'_se'] = self._dict[name+'_reps'].std(ddof=1)
+
+
+def resample(cells, rng):
+
+	# Multinomial counts of a resample drawn with replacement within each
+	# cell, so that every cell keeps its size.
+
+	counts = np.zeros(cells.shape[0])
+	for cell in np.unique(cells):
+		members = np.flatnonzero(cells==cell)
+		n = members.shape[0]
+		counts[members] = rng.multinomial(n, np.ones(n)/n)
+
+	return counts
+
+
+def ols_stat(arrays, adj, w):
+
+	# OLS estimates on the resample given by the frequency weights w.
+	# Each unit's row is scaled by the square root of its weight, which
+	# is equivalent to repeating the row w times.
+
+	Y, D, X = arrays
+	Xmean = w.dot(X) / w.sum()
+	keep = w > 0
+	Y, D, X, w = Y[keep], D[keep], X[keep], w[keep]
+
+	Z = form_matrix(D, X, adj, Xmean)
+	sw = np.sqrt(w)
+	olscoef = calc_coef(sw[:, None]*Z, sw*Y)
+
+	stats = {'ate': calc_ate(olscoef)}
+	if adj == 2:
+		w_c, w_t = w*(D==0), w*(D==1)
+		meandiff_c = w_c.dot(X)/w_c.sum() - Xmean
+		meandiff_t = w_t.dot(X)/w_t.sum() - Xmean
+		stats['atc'] = calc_atx(olscoef, meandiff_c)
+		stats['att'] = calc_atx(olscoef, meandiff_t)
+
+	return stats
+
+
+def weighting_stat(arrays, w):
+
+	Y, D, X, pscore = arrays
+	keep = w > 0
+	Y, D, X, pscore, w = Y[keep], D[keep], X[keep], pscore[keep], w[keep]
+
+	weights = calc_weights(pscore, D) * np.sqrt(w)
+	Y_w, Z_w = weigh_data(Y, D, X, weights)
+
+	return {'ate': calc_ate(calc_coef(Z_w, Y_w))}
+
+
+def blocking_stat(segments, adj, w):
+
+	# Within-stratum OLS on the resample, combined as in Blocking. Since
+	# resampling preserves the composition of every stratum, the
+	# stratum sizes are the same as in the full sample.
+
+	bounds = np.cumsum([0] + [segment[1].shape[0] for segment in segments])
+	Ns, N_cs, N_ts, atxs = [], [], [], []
+	for (j, segment) in enumerate(segments):
+		stats = ols_stat(segment, adj, w[bounds[j]:bounds[j+1]])
+		D = segment[1]
+		Ns.append(D.shape[0])
+		N_ts.append(D.sum())
+		N_cs.append(Ns[-1] - N_ts[-1])
+		atxs.append(stats)
+
+	ates = [stats['ate'] for stats in atxs]
+	atcs = [stats.get('atc', stats['ate']) for stats in atxs]
+	atts = [stats.get('att', stats['ate']) for stats in atxs]
+
+	return {'ate': combine_atx(ates, Ns), 'atc': combine_atx(atcs, N_cs),
+	        'att': combine_atx(atts, N_ts)}
+
+
+def matching_stat(arrays, w, W, matches=1, bias_adj=False,
+                  search='kdtree', block_mem=2**26, eps=0):
+
+	# Matching has to be redone on an actual copy of the resample, since
+	# the pool of potential matches changes from one resample to the
+	# next.
+
+	Y, D, X = arrays
+	rows = np.repeat(np.arange(Y.shape[0]), w.astype(int))
+	data = Data(Y[rows], D[rows], X[rows])
+	matching = Matching(data, W, matches, bias_adj, search, block_mem,
+	                    eps=eps)
+
+	return {name: matching[name] for name in ['ate', 'atc', 'att']}
@@ -1,8 +1,9 @@
 from __future__ import division
 import numpy as np
 from itertools import chain
-from functools import reduce
+from scipy.spatial import cKDTree
 
+import causalinference.utils.tools as tools
 from .base import Estimator
 
 
@@ -13,17 +14,20 @@ class Matching(Estimator):
 	errors are only computed when needed.
 	"""
 
-	def __init__(self, data, W, m, bias_adj):
+	def __init__(self, data, W, m, bias_adj, search='kdtree',
+	             block_mem=2**26, n_jobs=1, eps=0):
 
 		self._method = 'Matching'
 		N, N_c, N_t = data['N'], data['N_c'], data['N_t']
 		Y_c, Y_t = data['Y_c'], data['Y_t']
 		X_c, X_t = data['X_c'], data['X_t']
 
-		matches_c = [match(X_i, X_t, W, m) for X_i in X_c]
-		matches_t = [match(X_i, X_c, W, m) for X_i in X_t]
-		Yhat_c = np.array([Y_t[idx].mean() for idx in matches_c])
-		Yhat_t = np.array([Y_c[idx].mean() for idx in matches_t])
+		matches_c = match_all(X_c, X_t, W, m, search, block_mem,
+		                      n_jobs, eps=eps)
+		matches_t = match_all(X_t, X_c, W, m, search, block_mem,
+		                      n_jobs, eps=eps)
+		Yhat_c = match_means(Y_t, matches_c)
+		Yhat_t = match_means(Y_c, matches_t)
 		ITT_c = Yhat_c - Y_c
 		ITT_t = Y_t - Yhat_t
 
@@ -50,6 +54,72 @@ class Matching(Estimator):
 		                                   scaled_counts_c,
 						   scaled_counts_t)
 
+		if eps > 0:
+			infl_c = calc_inflation(X_c, X_t, W, m, matches_c)
+			infl_t = calc_inflation(X_t, X_c, W, m, matches_t)
+			self._dict['inflation'] = (N_c/N)*infl_c + (N_t/N)*infl_t
+
+
+class Matches(object):
+
+	"""
+	Match sets in compressed sparse row form. The matches of the ith unit
+	are indices[indptr[i]:indptr[i+1]], and each of them is given weight
+	weights[i], the reciprocal of the number of matches of that unit.
+	"""
+
+	def __init__(self, indptr, indices):
+
+		self.indptr = indptr
+		self.indices = indices
+		self.counts = np.diff(indptr)
+		self.weights = 1 / self.counts
+
+
+	def __len__(self):
+
+		return len(self.counts)
+
+
+	def __getitem__(self, index):
+
+		if not -len(self) <= index < len(self):
+			raise IndexError('Match set index out of range')
+		index = index % len(self)
+
+		return self.indices[self.indptr[index]:self.indptr[index+1]]
+
+
+	def __iter__(self):
+
+		return (self[i] for i in range(len(self)))
+
+
+def csr_matches(matches):
+
+	# Converts a list of index arrays, one per unit, to a Matches object.
+
+	counts = np.array([len(idx) for idx in matches], dtype=int)
+	indptr = np.concatenate(([0], np.cumsum(counts)))
+	if len(matches) > 0:
+		indices = np.concatenate(matches).astype(int)
+	else:
+		indices = np.empty(0, dtype=int)
+
+	return Matches(indptr, indices)
+
+
+def concat_matches(parts):
+
+	# Stacks the Matches of consecutive blocks of units.
+
+	offsets = np.cumsum([0] + [part.indptr[-1] for part in parts])
+	indptr = [[0]] + [part.indptr[1:]+offset
+	                  for part, offset in zip(parts, offsets)]
+	indices = [np.empty(0, dtype=int)] + [part.indices for part in parts]
+
+	return Matches(np.concatenate(indptr), np.concatenate(indices))
+
 
 def norm(X_i, X_m, W):
 
@@ -83,13 +153,204 @@ def match(X_i, X_m, W, m):
 	return smallestm(d, m)
 
 
+def whiten(X, W):
+
+	# Transforms the rows of X so that squared Euclidean distances between
+	# transformed rows equal the weighted distances computed by norm. For
+	# a full weighting matrix W = LL', this is X times the Cholesky factor.
+
+	if W.ndim == 1:
+		return X * np.sqrt(W)
+	else:
+		L = np.linalg.cholesky((W+W.T)/2)
+		return X.dot(L)
+
+
+def refine(X, X_m, W, m, rows, cols):
+
+	# Given candidate pairs (rows[j], cols[j]) that are known to contain
+	# every unit within the mth smallest distance of each row of X,
+	# recomputes exact distances with the same arithmetic as norm and
+	# keeps, for each row, all candidates no farther than the mth
+	# smallest. This reproduces the tie-inclusion behavior of smallestm.
+
+	dX = X_m[cols] - X[rows]
+	if W.ndim == 1:
+		d = (dX**2 * W).sum(1)
+	else:
+		d = (dX.dot(W)*dX).sum(1)
+
+	order = np.lexsort((d, rows))
+	rows, cols, d = rows[order], cols[order], d[order]
+	counts = np.bincount(rows, minlength=X.shape[0])
+	starts = np.cumsum(counts) - counts
+	keep = d <= d[starts+m-1][rows]
+	kept_counts = np.bincount(rows[keep], minlength=X.shape[0])
+	indptr = np.concatenate(([0], np.cumsum(kept_counts)))
+
+	return Matches(indptr, cols[keep])
+
+
+def kdtree_matcher(X_m, W, m, eps=0):
+
+	# Builds a KD-tree on the whitened matching pool and returns a function
+	# that matches blocks of rows against it. The tree gives the distance
+	# to the mth nearest neighbor, every unit within a slightly inflated
+	# radius of it is collected, and refine then settles ties exactly.
+	# Weighting matrices that are not positive definite cannot be
+	# whitened, in which case brute-force search is used instead.
+	#
+	# With eps > 0 the search is approximate: the tree may stop early and
+	# return m neighbors whose kth member is at most (1+eps) times as far
+	# as the true kth nearest neighbor. These are used as is, without
+	# the tie-completing refinement.
+
+	try:
+		Xw_m = whiten(X_m, W)
+	except np.linalg.LinAlgError:
+		return lambda X: csr_matches([match(X_i, X_m, W, m) for X_i in X])
+
+	tree = cKDTree(Xw_m)
+	pool_scale = np.abs(Xw_m).max()
+
+	def find_approx(X):
+		idx = tree.query(whiten(X, W), k=m, eps=eps)[1]
+		indptr = np.arange(0, m*X.shape[0]+1, m)
+		return Matches(indptr, idx.reshape(-1))
+
+	def find(X):
+		Xw = whiten(X, W)
+		dist = tree.query(Xw, k=m)[0]
+		if m > 1:
+			dist = dist[:, -1]
+		scale = np.abs(Xw).max() + pool_scale
+		radius = dist*(1+1e-6) + 1e-8*scale
+		candidates = tree.query_ball_point(Xw, radius)
+
+		counts = np.array([len(c) for c in candidates])
+		rows = np.repeat(np.arange(X.shape[0]), counts)
+		cols = np.fromiter(chain.from_iterable(candidates), dtype=int,
+		                   count=counts.sum())
+
+		return refine(X, X_m, W, m, rows, cols)
+
+	if eps > 0:
+		return find_approx
+	else:
+		return find
+
+
+def match_blocked(X, X_m, W, m, block_mem):
+
+	# Computes distances for tiles of rows of X at once, through the
+	# expansion d = aWa' + bWb' - 2aWb', where the cross term is a single
+	# matrix product. Tile height is chosen so that the distance tile and
+	# its temporaries fit in roughly block_mem bytes. Rounding in the
+	# expansion is absorbed by a tolerance on the mth smallest distance,
+	# and refine then settles the candidates exactly. Single-precision
+	# covariates are multiplied in single precision, with the tolerance
+	# widened to match. Both sets of covariates are first shifted by
+	# the mean of X_m, which leaves distances unchanged but keeps aa and
+	# bb, and hence the tolerance, on the scale of the distances rather
+	# than of the covariates.
+
+	dtype = np.result_type(X, X_m, np.float32)
+	center = X_m.mean(0, dtype=np.float64)
+	X_0 = (X - center).astype(dtype, copy=False)
+	X_m0 = (X_m - center).astype(dtype, copy=False)
+	if W.ndim == 1:
+		W_d = W.astype(dtype)
+		XW, X_mW = X_0 * W_d, X_m0 * W_d
+	else:
+		W_sym = ((W+W.T)/2).astype(dtype)
+		XW, X_mW = X_0.dot(W_sym), X_m0.dot(W_sym)
+	aa = (XW*X_0).sum(1)
+	bb = (X_mW*X_m0).sum(1)
+	bb_max = np.abs(bb).max()
+	rel_tol = max(1e-9, 100*np.finfo(dtype).eps)
+
+	N, N_m = X.shape[0], X_m.shape[0]
+	step = max(1, block_mem // (24*N_m))
+	matches = []
+	for start in range(0, N, step):
+		tile = slice(start, min(start+step, N))
+		d = aa[tile, None] + bb - 2*XW[tile].dot(X_m0.T)
+		kth = np.partition(d, m-1, axis=1)[:, m-1]
+		tol = rel_tol * (np.abs(aa[tile])+bb_max+np.abs(kth))
+		rows, cols = np.nonzero(d <= (kth+tol)[:, None])
+		matches.append(refine(X[tile], X_m, W, m, rows, cols))
+
+	return concat_matches(matches)
+
+
+def match_all(X, X_m, W, m, search, block_mem=2**26, n_jobs=1,
+              part_size=2**13, eps=0):
+
+	# Finds the matches in X_m of every row of X, returned as a Matches
+	# object. Rows of X are split into contiguous parts
+	# of at most part_size rows that are matched concurrently by n_jobs
+	# worker threads; since every search method is exact, the result
+	# does not depend on the split. Setting eps > 0 makes the KD-tree
+	# search approximate (see kdtree_matcher); it is only supported by
+	# the KD-tree search.
+
+	if eps > 0 and search != 'kdtree':
+		raise ValueError('Approximate matching requires KD-tree search.')
+	if search == 'brute':
+		find = lambda X: csr_matches([match(X_i, X_m, W, m) for X_i in X])
+	elif search == 'kdtree':
+		find = kdtree_matcher(X_m, W, m, eps)
+	elif search == 'blocked':
+		find = lambda X: match_blocked(X, X_m, W, m, block_mem)
+	else:
+		raise ValueError('Invalid search method.')
+
+	N = X.shape[0]
+	parts = [X[i:i+part_size] for i in range(0, N, part_size)]
+	results = tools.parallel_map(find, parts, n_jobs)
+
+	return concat_matches(results)
+
+
+def match_means(Y_m, matches):
+
+	# Averages Y_m over the match set of every unit.
+
+	sums = np.add.reduceat(Y_m[matches.indices], matches.indptr[:-1])
+
+	return sums * matches.weights
+
+
+def calc_inflation(X, X_m, W, m, matches, sample_size=1000):
+
+	# Measures how much farther approximate matches are than exact ones.
+	# For an evenly spaced sample of rows of X, the average distance to
+	# the units in each match set is compared with the same quantity
+	# under exact matching, and the relative excess is returned. Under
+	# KD-tree search with tolerance eps this is at most eps.
+
+	N = X.shape[0]
+	sample = np.unique(np.linspace(0, N-1, min(N, sample_size)).astype(int))
+	exact = match_all(X[sample], X_m, W, m, 'kdtree')
+
+	def mean_dist(X_i, idx):
+		return np.sqrt(np.abs(norm(X_i, X_m[idx], W))).mean()
+
+	dist_approx = sum(mean_dist(X[i], matches[i]) for i in sample)
+	dist_exact = sum(mean_dist(X[i], idx) for i, idx in zip(sample, exact))
+	if dist_exact == 0:
+		return 0.0
+	else:
+		return dist_approx/dist_exact - 1
+
+
 def bias_coefs(matches, Y_m, X_m):
 
 	# Computes OLS coefficient in bias correction regression. Constructs
 	# data for regression by including (possibly multiple times) every
 	# observation that has appeared in the matched sample.
 
-	flat_idx = reduce(lambda x,y: np.concatenate((x,y)), matches)
+	flat_idx = matches.indices
 	N, K = len(flat_idx), X_m.shape[1]
 
 	Y = Y_m[flat_idx]
@@ -106,10 +367,11 @@ def bias(X, X_m, matches, coefs):
 	# product of the matching discrepancy (i.e., X-X_matched) and the
 	# coefficients from the bias correction regression.
 
-	X_m_mean = [X_m[idx].mean(0) for idx in matches]
-	bias_list = [(X_j-X_i).dot(coefs) for X_i,X_j in zip(X, X_m_mean)]
+	# Since the correction is linear in X, the average over each match
+	# set is taken of the fitted values X_m.dot(coefs) rather than of
+	# the rows of X_m themselves.
 
-	return np.array(bias_list)
+	return match_means(X_m.dot(coefs), matches) - X.dot(coefs)
 
 
 def scaled_counts(N, matches):
@@ -117,14 +379,9 @@ def scaled_counts(N, matches):
 	# Counts the number of times each subject has appeared as a match. In
 	# the case of multiple matches, each subject only gets partial credit.
 
-	s_counts = np.zeros(N)
-
-	for matches_i in matches:
-		scale = 1 / len(matches_i)
-		for match in matches_i:
-			s_counts[match] += scale
+	scales = np.repeat(matches.weights, matches.counts)
 
-	return s_counts
+	return np.bincount(matches.indices, weights=scales, minlength=N)
 
 
 def calc_atx_var(vars_c, vars_t, weights_c, weights_t):
@@ -3,6 +3,7 @@ import numpy as np
 import scipy.linalg
 
 from .base import Estimator
+import causalinference.utils.tools as tools
 
 
 class OLS(Estimator):
@@ -11,32 +12,124 @@ class OLS(Estimator):
 	Dictionary-like class containing treatment effect estimates.
 	"""
 
-	def __init__(self, data, adj):
+	def __init__(self, data, adj, Y=None, se='robust', B=1000, seed=None,
+	             block_rows=2**14):
 
 		self._method = 'OLS'
-		Y, D, X = data['Y'], data['D'], data['X']
-		X_c, X_t = data['X_c'], data['X_t']
+		D, X = data['D'], data['X']
+		if Y is None:
+			Y = data['Y']
+		elif Y.shape[0] != data['N']:
+			raise IndexError('Input data have different number of rows')
 
-		Z = form_matrix(D, X, adj)
-		olscoef = np.linalg.lstsq(Z, Y)[0]
+		Xmean = X.mean(0, dtype=np.float64)
+		fit = calc_ols((Y, D, X), block_rows, adj, Xmean, se, B, seed)
+		fill_estimates(self, adj, *fit)
+
+
+class ChunkedOLS(Estimator):
+
+	"""
+	Dictionary-like class containing treatment effect estimates,
+	computed out of core from data supplied in row chunks.
+
+	The data are read twice: the first pass accumulates the triangular
+	factor of Z and the products Z'Y chunk by chunk, which yield the
+	coefficients, and the second pass accumulates the robust covariance
+	from the residuals. The full design matrix is never formed.
+
+	Parameters
+	----------
+	chunks: tuple or callable
+		Either a tuple (Y, D, X) of arrays, possibly memory-mapped,
+		to be read chunk_rows rows at a time, or a callable that
+		returns a fresh iterable of (Y, D, X) chunks each time it
+		is called, such as a generator function.
+	adj: int (0, 1, or 2)
+		Same as in CausalModel.est_via_ols.
+	chunk_rows: int, optional
+		Number of rows per chunk when chunks is a tuple of arrays.
+		Defaults to 2**16.
+	"""
+
+	def __init__(self, chunks, adj, chunk_rows=2**16):
+
+		self._method = 'OLS'
+		fit = calc_ols(chunks, chunk_rows, adj)
+		fill_estimates(self, adj, *fit)
+
+
+def fill_estimates(estimator, adj, coef, cov, meandiff_c=None,
+                   meandiff_t=None):
+
+	# Stores the ATE of a regression with the treatment coefficient at
+	# index 1, and for adj = 2 also the ATC and ATT, with their
+	# standard errors, in the dictionary of estimator.
+
+	estimator._dict = dict()
+	estimator._dict['ate'] = calc_ate(coef)
+	estimator._dict['ate_se'] = calc_ate_se(cov)
+
+	if adj == 2:
+		estimator._dict['atc'] = calc_atx(coef, meandiff_c)
+		estimator._dict['att'] = calc_atx(coef, meandiff_t)
+		estimator._dict['atc_se'] = calc_atx_se(cov, meandiff_c)
+		estimator._dict['att_se'] = calc_atx_se(cov, meandiff_t)
+
+
+def calc_ols(chunks, chunk_rows, adj, Xref=None, se='robust', B=1000,
+             seed=None):
+
+	# Least squares coefficients, their covariance matrix, and the
+	# differences between the group and overall covariate means, from
+	# two passes over blocks of rows, as in calc_wls. The first pass
+	# updates the triangular factor of Z with the covariates centered
+	# at Xref (zero if not given), and sums Z'Y and the covariates of
+	# each group. Recentering at the actual mean is an upper-triangular
+	# change of basis of the factor. The second pass sums the meat of
+	# the sandwich, or the wild bootstrap perturbations, from the
+	# residuals. Only one block of the design exists at a time.
+
+	if se not in ('robust', 'wild'):
+		raise ValueError('Invalid standard error method.')
+
+	R, ZtY = None, 0
+	N, N_t, sum_c, sum_t = 0, 0, 0, 0
+	for (Y, D, X) in tools.iter_chunks(chunks, chunk_rows):
+		K = X.shape[1]
+		if Xref is None:
+			Xref = np.zeros(K)
+		Z = form_matrix(D, X, adj, Xref)
+		R = update_r(R, Z)
+		ZtY = ZtY + Z.T.dot(Y)
+		N += D.shape[0]
+		N_t += D.sum()
+		sum_t = sum_t + X[D==1].sum(0, dtype=np.float64)
+		sum_c = sum_c + X[D==0].sum(0, dtype=np.float64)
+
+	Xmean = (sum_c+sum_t) / N
+	R_c = R.dot(recenter(R.shape[1], adj, Xmean-Xref))
+	olscoef = scipy.linalg.solve_triangular(R_c, calc_qty(R, ZtY))
+
+	acc = 0
+	rng = np.random.RandomState(seed)
+	for (Y, D, X) in tools.iter_chunks(chunks, chunk_rows):
+		Z = form_matrix(D, X, adj, Xmean)
 		u = Y - Z.dot(olscoef)
-		cov = calc_cov(Z, u)
+		if se == 'robust':
+			acc = acc + calc_meat(Z, u, R_c)
+		else:
+			acc = acc + calc_wild(Z, u, R_c, rng, B)
 
-		self._dict = dict()
-		self._dict['ate'] = calc_ate(olscoef)
-		self._dict['ate_se'] = calc_ate_se(cov)
+	if se == 'robust':
+		cov = sandwich(acc, R_c)
+	else:
+		cov = wild_cov(acc, R_c)
 
-		if adj == 2:
-			Xmean = X.mean(0)
-			meandiff_c = X_c.mean(0) - Xmean
-			meandiff_t = X_t.mean(0) - Xmean
-			self._dict['atc'] = calc_atx(olscoef, meandiff_c)
-			self._dict['att'] = calc_atx(olscoef, meandiff_t)
-			self._dict['atc_se'] = calc_atx_se(cov, meandiff_c)
-			self._dict['att_se'] = calc_atx_se(cov, meandiff_t)
+	return (olscoef, cov, sum_c/(N-N_t) - Xmean, sum_t/N_t - Xmean)
 
 
-def form_matrix(D, X, adj):
+def form_matrix(D, X, adj, Xmean=None):
 
 	N, K = X.shape
 
@@ -51,7 +144,9 @@ def form_matrix(D, X, adj):
 	Z[:, 0] = 1  # intercept term
 	Z[:, 1] = D
 	if adj >= 1:
-		dX = X - X.mean(0)
+		if Xmean is None:
+			Xmean = X.mean(0, dtype=np.float64)
+		dX = X - Xmean
 		Z[:, 2:2+K] = dX
 	if adj == 2:
 		Z[:, 2+K:] = D[:, None] * dX
@@ -59,6 +154,68 @@ def form_matrix(D, X, adj):
 	return Z
 
 
+def recenter(P, adj, shift):
+
+	# Upper-triangular T such that Z T is the design of form_matrix
+	# with the covariates centered at a mean shift away from those of
+	# Z. Only the intercept and treatment columns change, by minus the
+	# shift times the covariate and interaction columns.
+
+	K = shift.shape[0]
+	T = np.identity(P)
+	if adj >= 1:
+		T[0, 2:2+K] = -shift
+	if adj == 2:
+		T[1, 2+K:] = -shift
+
+	return T
+
+
+def fit_qr(Z, Y, block_rows=2**14):
+
+	# Least squares coefficients of every column of Y on Z, through the
+	# triangular factor R of Z, built over blocks of rows so that Q is
+	# never formed. The outcomes enter only through Z'Y, one matrix
+	# product per block, and R b = Q'Y is solved for all of them at
+	# once. For an N x M matrix Y, the coefficients form a P x M
+	# matrix. R is returned as well so the covariance can reuse it.
+
+	N, P = Z.shape
+	R, ZtY = None, 0
+	for start in range(0, N, block_rows):
+		Z_b = Z[start:start+block_rows]
+		R = update_r(R, Z_b)
+		ZtY = ZtY + Z_b.T.dot(Y[start:start+block_rows])
+	coef = scipy.linalg.solve_triangular(R, calc_qty(R, ZtY))
+
+	return (coef, R)
+
+
+def calc_coef(Z, Y):
+
+	return fit_qr(Z, Y)[0]
+
+
+def update_r(R, Z):
+
+	# One step of a tall-skinny QR: the triangular factor of Z over all
+	# rows seen so far, from the previous factor R and a new chunk of
+	# rows.
+
+	if R is not None:
+		Z = np.vstack((R, Z))
+
+	return np.linalg.qr(Z, mode='r')
+
+
+def calc_qty(R, ZtY):
+
+	# Q'Y for Z = QR, from Z'Y = R'Q'Y by a triangular solve, so that
+	# the coefficients solve R b = Q'Y.
+
+	return scipy.linalg.solve_triangular(R, ZtY, trans='T')
+
+
 def calc_ate(olscoef):
 
 	return olscoef[1]  # coef of treatment variable
@@ -71,34 +228,141 @@ def calc_atx(olscoef, meandiff):
 	return olscoef[1] + np.dot(meandiff, olscoef[2+K:])
 
 
-def calc_cov(Z, u):
+def calc_cov(Z, u, R=None, block_rows=2**14):
+
+	# Heteroskedasticity-robust covariance matrix of the coefficients.
+	# With Z = QR, the sandwich inv(Z'Z) Z'diag(u^2)Z inv(Z'Z) equals
+	# inv(R) Q'diag(u^2)Q inv(R)'. The meat is accumulated over blocks
+	# of rows, recovering each block of Q by a triangular solve, so no
+	# N x P temporary is formed and Z'Z is never inverted. For an
+	# N x M matrix of residuals u, returns the M covariance matrices
+	# stacked along the first axis.
+
+	if R is None:
+		R = np.linalg.qr(Z, mode='r')
+
+	return sandwich(calc_meat(Z, u, R, block_rows), R)
+
+
+def calc_meat(Z, u, R, block_rows=2**14):
+
+	# Q'diag(u^2)Q, accumulated over blocks of rows of Z = QR.
+
+	N, P = Z.shape
+
+	meat = np.zeros(u.shape[1:] + (P, P))
+	for start in range(0, N, block_rows):
+		Z_b = Z[start:start+block_rows]
+		Q_b = scipy.linalg.solve_triangular(R, Z_b.T, trans='T').T
+		u_b = u[start:start+block_rows]
+		if u.ndim == 1:
+			uQ_b = u_b[:, None] * Q_b
+			meat += uQ_b.T.dot(uQ_b)
+		else:
+			meat += tools.sum_outer(u_b**2, Q_b)
+
+	return meat
+
+
+def sandwich(meat, R):
+
+	# inv(R) meat inv(R)'.
+
+	P = R.shape[0]
+	R_inv = scipy.linalg.solve_triangular(R, np.eye(P))
+
+	return np.einsum('ip,...pq,jq->...ij', R_inv, meat, R_inv)
+
+
+def calc_cov_wild(Z, u, R=None, B=1000, seed=None, block_rows=None):
+
+	# Covariance matrix of the coefficients by the wild (multiplier)
+	# bootstrap with Rademacher multipliers v. Replicate b perturbs the
+	# coefficients by inv(Z'Z) Z'(v_b*u) = inv(R) Q'(v_b*u), so all B
+	# replicates follow from one matrix product per block of rows; see
+	# calc_wild. The B x N multipliers are drawn a block at a time.
+
+	if R is None:
+		R = np.linalg.qr(Z, mode='r')
+	rng = np.random.RandomState(seed)
+	delta = calc_wild(Z, u, R, rng, B, block_rows)
+
+	return wild_cov(delta, R)
+
+
+def calc_wild(Z, u, R, rng, B, block_rows=None):
+
+	# Sum over blocks of rows of (v*u)'Q, for a B x block matrix v of
+	# Rademacher multipliers. Blocks hold about 2**23 multipliers by
+	# default.
+
+	N, P = Z.shape
+	if block_rows is None:
+		block_rows = max(1, 2**23 // B)
+
+	delta = np.zeros(u.shape[1:] + (B, P))
+	for start in range(0, N, block_rows):
+		Z_b = Z[start:start+block_rows]
+		Q_b = scipy.linalg.solve_triangular(R, Z_b.T, trans='T').T
+		u_b = u[start:start+block_rows]
+		v = 2.0*rng.randint(0, 2, size=(B, Z_b.shape[0])) - 1
+		if u.ndim == 1:
+			delta += (v*u_b).dot(Q_b)
+		else:
+			delta += calc_wild_multi(v, u_b, Q_b)
+
+	return delta
+
+
+def calc_wild_multi(v, u, Q):
+
+	# (v*u[:, m])'Q for every column m of u, as a matrix product of v
+	# with the row-wise products of u and Q, taken over sub-blocks of
+	# about 2**22 entries.
+
+	(n, M), P = u.shape, Q.shape[1]
+	step = max(1, 2**22 // (M*P))
+
+	acc = np.zeros((v.shape[0], M*P))
+	for start in range(0, n, step):
+		uQ = u[start:start+step, :, None] * Q[start:start+step, None, :]
+		acc += v[:, start:start+step].dot(uQ.reshape(-1, M*P))
+
+	return acc.reshape(-1, M, P).transpose(1, 0, 2)
+
+
+def wild_cov(delta, R):
+
+	# Covariance of the replicate perturbations inv(R) delta_b, which
+	# have mean zero by construction.
 
-	A = np.linalg.inv(np.dot(Z.T, Z))
-	B = np.dot(u[:, None]*Z, A)
+	B, P = delta.shape[-2:]
+	R_inv = scipy.linalg.solve_triangular(R, np.eye(P))
+	draws = np.einsum('...bp,qp->...bq', delta, R_inv)
 
-	return np.dot(B.T, B)
+	return np.einsum('...bp,...bq->...pq', draws, draws) / B
 
 
 def submatrix(cov):
 
-	K = (cov.shape[0]-2) // 2
-	submat = np.empty((1+K, 1+K))
-	submat[0,0] = cov[1,1]
-	submat[0,1:] = cov[1,2+K:]
-	submat[1:,0] = cov[2+K:,1]
-	submat[1:,1:] = cov[2+K:, 2+K:]
+	K = (cov.shape[-1]-2) // 2
+	submat = np.empty(cov.shape[:-2] + (1+K, 1+K))
+	submat[..., 0, 0] = cov[..., 1, 1]
+	submat[..., 0, 1:] = cov[..., 1, 2+K:]
+	submat[..., 1:, 0] = cov[..., 2+K:, 1]
+	submat[..., 1:, 1:] = cov[..., 2+K:, 2+K:]
 
 	return submat
 
 
 def calc_ate_se(cov):
 
-	return np.sqrt(cov[1,1])
+	return np.sqrt(cov[..., 1, 1])
 
 
 def calc_atx_se(cov, meandiff):
 
 	a = np.concatenate((np.array([1]), meandiff))
 
-	return np.sqrt(a.dot(submatrix(cov)).dot(a))
+	return np.sqrt(np.einsum('i,...ij,j->...', a, submatrix(cov), a))
 
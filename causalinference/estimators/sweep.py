@@ -0,0 +1,312 @@
+from __future__ import division
+import numpy as np
+import scipy.linalg
+
+from .base import Estimator
+from .ols import form_matrix, recenter, update_r, calc_qty, sandwich
+from .ols import calc_ate, calc_ate_se, calc_atx, calc_atx_se
+from .weighting import calc_weights, weigh_data
+from ..core import Dict
+from ..core.summary import calc_ndiff
+import causalinference.utils.tools as tools
+
+
+class Sweep(Dict):
+
+	"""
+	Dictionary-like class containing sample sizes, summary statistics,
+	and treatment effect estimates for the subsamples obtained by
+	trimming at each of a list of cutoffs.
+
+	A cutoff c keeps the units whose propensity score p satisfies
+	c <= p <= 1-c, as CausalModel.trim does. These subsamples are
+	nested, so units are sorted once by the number of cutoffs that
+	keep them, and every subsample is a prefix of the sorted units. The
+	prefixes are processed from the smallest to the largest. Group
+	means and variances are merged in as units are added, and the
+	triangular factor of each regression is updated with the added
+	rows. This is a stable counterpart of updating Gram matrices.
+	Standard errors of all subsamples are accumulated in one further
+	pass over the units.
+
+	Statistics are kept as arrays with one entry (or row) per cutoff,
+	in the order given. Estimates are kept under the keys 'ols' and
+	'weighting'.
+	"""
+
+	def __init__(self, data, cutoffs, estimators=('ols',), adj=2,
+	             block_rows=2**14):
+
+		cutoffs = np.asarray(cutoffs, dtype=float)
+		if ((cutoffs < 0) | (cutoffs > 0.5)).any():
+			raise ValueError('Invalid cutoff.')
+		for estimator in estimators:
+			if estimator not in ('ols', 'weighting'):
+				raise ValueError('Invalid estimator.')
+
+		Y, D, X = data['Y'], data['D'], data['X']
+		pscore, K = data['pscore'], data['K']
+		order, sizes = nest_units(pscore, cutoffs)
+
+		# distinct prefix sizes, smallest first
+		bounds, cut_index = np.unique(sizes, return_inverse=True)
+		stats = sweep_summary(Y, D, X, order, bounds, block_rows)
+		if (K+1 > stats['N_c']).any():
+			raise ValueError('Too few control units: N_c < K+1')
+		if (K+1 > stats['N_t']).any():
+			raise ValueError('Too few treated units: N_t < K+1')
+
+		self._dict = dict()
+		self._dict['cutoffs'] = cutoffs
+		for key in stats.keys():
+			self._dict[key] = stats[key][cut_index]
+
+		for estimator in estimators:
+			if estimator == 'ols':
+				est = sweep_ols(Y, D, X, adj, order, bounds, stats,
+				                block_rows)
+			else:
+				est = sweep_weighting(Y, D, X, pscore, order, bounds,
+				                      block_rows)
+			for key in est.keys():
+				est._dict[key] = est[key][cut_index]
+			self._dict[estimator] = est
+
+
+	def __str__(self):
+
+		table_width = 80
+
+		names = [name for name in ('ols', 'weighting') if name in self._dict]
+
+		output = '\n'
+		output += 'Trimming Sweep\n\n'
+
+		entries1 = ['Cutoff', 'N_c', 'N_t', 'Raw-diff']
+		for name in names:
+			entries1 += [self[name]._method, 'S.e.']
+		entry_types1 = ['string']*len(entries1)
+		col_spans1 = [1]*len(entries1)
+		output += tools.add_row(entries1, entry_types1,
+		                        col_spans1, table_width)
+		output += tools.add_line(table_width)
+
+		entry_types2 = ['float', 'integer', 'integer', 'float']
+		entry_types2 += ['float', 'float']*len(names)
+		for j in range(len(self['cutoffs'])):
+			entries2 = [self['cutoffs'][j], self['N_c'][j],
+			            self['N_t'][j], self['rdiff'][j]]
+			for name in names:
+				entries2 += [self[name]['ate'][j], self[name]['ate_se'][j]]
+			output += tools.add_row(entries2, entry_types2,
+			                        col_spans1, table_width)
+
+		return output
+
+
+class SweepEstimates(Estimator):
+
+	"""
+	Dictionary-like class containing treatment effect estimates, with
+	one entry per trimming cutoff.
+	"""
+
+	def __init__(self, method, estimates):
+
+		self._method = method
+		self._dict = estimates
+
+
+def nest_units(pscore, cutoffs):
+
+	# Order of the units under which the subsample kept by each cutoff
+	# is a prefix, and the lengths of those prefixes. Both conditions
+	# of CausalModel.trim, p >= c and p <= 1-c, are evaluated exactly as
+	# there. Each holds for a leading run of the sorted cutoffs, since
+	# 1-c does not increase with c, so a unit is kept by the smallest
+	# depth cutoffs, where depth is the shorter of the two runs.
+
+	levels = np.unique(cutoffs)
+	n_low = np.searchsorted(levels, pscore, 'right')
+	n_high = np.searchsorted(-(1-levels), -pscore, 'right')
+	depth = np.minimum(n_low, n_high)
+	order = np.argsort(-depth, kind='mergesort')
+
+	counts = np.bincount(depth, minlength=len(levels)+1)
+	kept = np.cumsum(counts[::-1])[::-1][1:]  # units with depth > k
+
+	return (order, kept[np.searchsorted(levels, cutoffs)])
+
+
+def merge_moments(moments, values):
+
+	# Merges the count, mean, and sum of squared deviations of a new
+	# batch of values into running ones, by the pairwise update of Chan
+	# et al., which avoids the cancellation of raw sums of squares.
+
+	n, mean, M2 = moments
+	n_b = values.shape[0]
+	if n_b == 0:
+		return moments
+	mean_b = values.mean(0, dtype=np.float64)
+	M2_b = ((values-mean_b)**2).sum(0)
+	delta = mean_b - mean
+	n_new = n + n_b
+
+	return (n_new, mean + delta*n_b/n_new, M2 + M2_b + delta**2*n*n_b/n_new)
+
+
+def sweep_summary(Y, D, X, order, bounds, block_rows):
+
+	# Group sizes, means, and standard deviations of Y and X over every
+	# prefix order[:bound].
+
+	K = X.shape[1]
+	Y_mom = [(0, 0.0, 0.0), (0, 0.0, 0.0)]
+	X_mom = [(0, np.zeros(K), np.zeros(K)), (0, np.zeros(K), np.zeros(K))]
+	names = ['N_c', 'N_t', 'Y_c_mean', 'Y_t_mean', 'Y_c_sd', 'Y_t_sd',
+	         'X_c_mean', 'X_t_mean', 'X_c_sd', 'X_t_sd']
+	snapshots = dict((name, []) for name in names)
+
+	lo = 0
+	for hi in bounds:
+		for start in range(lo, hi, block_rows):
+			rows = order[start:min(start+block_rows, hi)]
+			D_b = D[rows]
+			for group in (0, 1):
+				Y_mom[group] = merge_moments(Y_mom[group],
+				                             Y[rows[D_b==group]])
+				X_mom[group] = merge_moments(X_mom[group],
+				                             X[rows[D_b==group]])
+		lo = hi
+		for (group, g) in [(0, 'c'), (1, 't')]:
+			n, Y_mean, Y_M2 = Y_mom[group]
+			X_mean, X_M2 = X_mom[group][1:]
+			snapshots['N_'+g].append(n)
+			snapshots['Y_'+g+'_mean'].append(Y_mean)
+			snapshots['Y_'+g+'_sd'].append(np.sqrt(Y_M2/max(n-1, 1)))
+			snapshots['X_'+g+'_mean'].append(X_mean)
+			snapshots['X_'+g+'_sd'].append(np.sqrt(X_M2/max(n-1, 1)))
+
+	stats = dict((name, np.array(snapshots[name])) for name in names)
+	stats['N'] = stats['N_c'] + stats['N_t']
+	stats['rdiff'] = stats['Y_t_mean'] - stats['Y_c_mean']
+	stats['ndiff'] = calc_ndiff(stats['X_c_mean'], stats['X_t_mean'],
+	                            stats['X_c_sd'], stats['X_t_sd'])
+
+	return stats
+
+
+def sweep_r(design, bounds, block_rows):
+
+	# Triangular factor of Z and the products Z'Y over every prefix of
+	# the sorted units, by adding blocks of rows to those of the
+	# previous prefix.
+
+	R, ZtY, Rs, ZtYs, lo = None, 0, [], [], 0
+	for hi in bounds:
+		for start in range(lo, hi, block_rows):
+			Z, Y = design(start, min(start+block_rows, hi))
+			R = update_r(R, Z)
+			ZtY = ZtY + Z.T.dot(Y)
+		Rs.append(R)
+		ZtYs.append(ZtY)
+		lo = hi
+
+	return (Rs, ZtYs)
+
+
+def sweep_meat(design, bounds, coefs, block_rows):
+
+	# Z'diag(u^2)Z over every prefix, in one pass over the sorted units.
+	# Units between bounds[j-1] and bounds[j] belong to prefixes j and
+	# up, whose residuals are computed from their coefficients, the
+	# columns j and up of coefs.
+
+	P = coefs.shape[0]
+	meats = np.zeros((len(bounds), P, P))
+	lo = 0
+	for (j, hi) in enumerate(bounds):
+		for start in range(lo, hi, block_rows):
+			Z, Y = design(start, min(start+block_rows, hi))
+			u = Y[:, None] - Z.dot(coefs[:, j:])
+			meats[j:] += tools.sum_outer(u**2, Z)
+		lo = hi
+
+	return meats
+
+
+def q_meat(meat, R):
+
+	# inv(R)' meat inv(R), the meat in the basis of Q for Z = QR.
+
+	A = scipy.linalg.solve_triangular(R, meat, trans='T')
+
+	return scipy.linalg.solve_triangular(R, A.T, trans='T').T
+
+
+def sweep_ols(Y, D, X, adj, order, bounds, stats, block_rows):
+
+	# The design is centered at the covariate means of the largest
+	# prefix; the shift to the means of each prefix is an upper-
+	# triangular change of basis of its factor, as in ChunkedOLS.
+
+	Xmeans = (stats['N_c'][:, None]*stats['X_c_mean'] +
+	          stats['N_t'][:, None]*stats['X_t_mean']) / stats['N'][:, None]
+	Xref = Xmeans[-1]
+	design = lambda start, end: (form_matrix(D[order[start:end]],
+	                                         X[order[start:end]], adj,
+	                                         Xref),
+	                             Y[order[start:end]])
+	Rs, ZtYs = sweep_r(design, bounds, block_rows)
+	P = Rs[0].shape[1]
+
+	R_cs, QtYs, coefs = [], [], []
+	for (j, R) in enumerate(Rs):
+		R_cs.append(R.dot(recenter(P, adj, Xmeans[j]-Xref)))
+		QtYs.append(calc_qty(R, ZtYs[j]))
+		coefs.append(scipy.linalg.solve_triangular(R, QtYs[j]))
+	meats = sweep_meat(design, bounds, np.column_stack(coefs), block_rows)
+
+	estimates = dict((name, []) for name in ['ate', 'ate_se'])
+	if adj == 2:
+		for name in ['atc', 'att', 'atc_se', 'att_se']:
+			estimates[name] = []
+	for (j, R) in enumerate(Rs):
+		olscoef = scipy.linalg.solve_triangular(R_cs[j], QtYs[j])
+		cov = sandwich(q_meat(meats[j], R), R_cs[j])
+		estimates['ate'].append(calc_ate(olscoef))
+		estimates['ate_se'].append(calc_ate_se(cov))
+		if adj == 2:
+			meandiff_c = stats['X_c_mean'][j] - Xmeans[j]
+			meandiff_t = stats['X_t_mean'][j] - Xmeans[j]
+			estimates['atc'].append(calc_atx(olscoef, meandiff_c))
+			estimates['att'].append(calc_atx(olscoef, meandiff_t))
+			estimates['atc_se'].append(calc_atx_se(cov, meandiff_c))
+			estimates['att_se'].append(calc_atx_se(cov, meandiff_t))
+
+	return SweepEstimates('OLS', dict((name, np.array(values)) for
+	                                  (name, values) in estimates.items()))
+
+
+def sweep_weighting(Y, D, X, pscore, order, bounds, block_rows):
+
+	def design(start, end):
+		rows = order[start:end]
+		weights = calc_weights(pscore[rows], D[rows])
+		Y_w, Z_w = weigh_data(Y[rows], D[rows], X[rows], weights)
+		return (Z_w, Y_w)
+
+	Rs, ZtYs = sweep_r(design, bounds, block_rows)
+	coefs = [scipy.linalg.solve_triangular(R, calc_qty(R, ZtY))
+	         for (R, ZtY) in zip(Rs, ZtYs)]
+	meats = sweep_meat(design, bounds, np.column_stack(coefs), block_rows)
+
+	ates, ate_ses = [], []
+	for (j, R) in enumerate(Rs):
+		cov = sandwich(q_meat(meats[j], R), R)
+		ates.append(calc_ate(coefs[j]))
+		ate_ses.append(calc_ate_se(cov))
+
+	return SweepEstimates('Weighting', {'ate': np.array(ates),
+	                                    'ate_se': np.array(ate_ses)})
@@ -1,8 +1,11 @@
 from __future__ import division
 import numpy as np
+import scipy.linalg
 
 from .base import Estimator
-from .ols import calc_cov, calc_ate, calc_ate_se
+from .ols import fill_estimates, update_r, calc_qty, calc_meat, sandwich
+from .ols import calc_wild, wild_cov
+import causalinference.utils.tools as tools
 
 
 class Weighting(Estimator):
@@ -11,22 +14,80 @@ class Weighting(Estimator):
 	Dictionary-like class containing treatment effect estimates.
 	"""
 
-	def __init__(self, data):
+	def __init__(self, data, block_rows=2**14, se='robust', B=1000,
+	             seed=None):
 
 		self._method = 'Weighting'
-		Y, D, X = data['Y'], data['D'], data['X']
-		pscore = data['pscore']
+		chunks = (data['Y'], data['D'], data['X'], data['pscore'])
+		wlscoef, cov = calc_wls(chunks, block_rows, se, B, seed)
+		fill_estimates(self, 0, wlscoef, cov)
 
+
+class ChunkedWeighting(Estimator):
+
+	"""
+	Dictionary-like class containing treatment effect estimates,
+	computed out of core from data supplied in row chunks.
+
+	As with ChunkedOLS, the data are read twice, once for the
+	coefficients and once for the robust covariance, and the full
+	weighted design matrix is never formed.
+
+	Parameters
+	----------
+	chunks: tuple or callable
+		Either a tuple (Y, D, X, pscore) of arrays, possibly
+		memory-mapped, to be read chunk_rows rows at a time, or a
+		callable that returns a fresh iterable of (Y, D, X, pscore)
+		chunks each time it is called.
+	chunk_rows: int, optional
+		Number of rows per chunk when chunks is a tuple of arrays.
+		Defaults to 2**16.
+	"""
+
+	def __init__(self, chunks, chunk_rows=2**16):
+
+		self._method = 'Weighting'
+		wlscoef, cov = calc_wls(chunks, chunk_rows)
+		fill_estimates(self, 0, wlscoef, cov)
+
+
+def calc_wls(chunks, chunk_rows, se='robust', B=1000, seed=None):
+
+	# Weighted least squares coefficients and their robust covariance
+	# matrix, from two passes over blocks of rows. The first updates
+	# the triangular factor of the weighted Z and sums the weighted
+	# Z'Y, the second sums the meat of the sandwich, or the wild
+	# bootstrap perturbations, from the weighted residuals. Only one
+	# block of the weighted design exists at a time.
+
+	if se not in ('robust', 'wild'):
+		raise ValueError('Invalid standard error method.')
+
+	R_Z, ZtY = None, 0
+	for (Y, D, X, pscore) in tools.iter_chunks(chunks, chunk_rows):
 		weights = calc_weights(pscore, D)
 		Y_w, Z_w = weigh_data(Y, D, X, weights)
+		R_Z = update_r(R_Z, Z_w)
+		ZtY = ZtY + Z_w.T.dot(Y_w)
 
-		wlscoef = np.linalg.lstsq(Z_w, Y_w)[0]
-		u_w = Y_w - Z_w.dot(wlscoef)
-		cov = calc_cov(Z_w, u_w)
+	wlscoef = scipy.linalg.solve_triangular(R_Z, calc_qty(R_Z, ZtY))
 
-		self._dict = dict()
-		self._dict['ate'] = calc_ate(wlscoef)
-		self._dict['ate_se'] = calc_ate_se(cov)
+	acc = 0
+	rng = np.random.RandomState(seed)
+	for (Y, D, X, pscore) in tools.iter_chunks(chunks, chunk_rows):
+		weights = calc_weights(pscore, D)
+		Y_w, Z_w = weigh_data(Y, D, X, weights)
+		u_w = Y_w - Z_w.dot(wlscoef)
+		if se == 'robust':
+			acc = acc + calc_meat(Z_w, u_w, R_Z)
+		else:
+			acc = acc + calc_wild(Z_w, u_w, R_Z, rng, B)
+
+	if se == 'robust':
+		return (wlscoef, sandwich(acc, R_Z))
+	else:
+		return (wlscoef, wild_cov(acc, R_Z))
 
 
 def calc_weights(pscore, D):
@@ -1,2 +1,3 @@
 from .tools import random_data, vignette_data, lalonde_data
+from .tools import read_npy, write_npy, tsv_to_npy
 
@@ -1,6 +1,9 @@
 import numpy as np
 from scipy.stats import norm, logistic
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
+import os
 from os import path
 lalonde_file = path.join(path.dirname(__file__), 'lalonde_data.txt')
 vignette_file = path.join(path.dirname(__file__), 'vignette_data.txt')
@@ -51,6 +54,71 @@ def gen_reg_entries(varname, coef, se):
 	return (varname, coef, se, z, p, lw, up)
 
 
+def n_workers(n_jobs):
+
+	# Number of workers that n_jobs stands for; -1 means one per CPU.
+
+	if n_jobs < 0:
+		return cpu_count()
+	else:
+		return max(n_jobs, 1)
+
+
+def parallel_map(func, items, n_jobs=1):
+
+	# Applies func to every element of items, using a pool of n_jobs
+	# threads when n_jobs is greater than one (-1 means one thread per
+	# CPU). Results come back in the order of items. Workers share memory
+	# with the caller, so large arrays are never copied or pickled, and
+	# the heavy NumPy/SciPy routines release the GIL while they run.
+
+	n_jobs = n_workers(n_jobs)
+	if n_jobs <= 1 or len(items) <= 1:
+		return [func(item) for item in items]
+
+	pool = ThreadPool(min(n_jobs, len(items)))
+	try:
+		return pool.map(func, items)
+	finally:
+		pool.close()
+		pool.join()
+
+
+def iter_chunks(chunks, chunk_rows):
+
+	# Iterable of tuples of arrays, one tuple per chunk of rows. chunks
+	# is either a callable returning such an iterable, which lets the
+	# data be read more than once, or a tuple of equally long arrays,
+	# possibly memory-mapped, which are sliced without copying.
+
+	if callable(chunks):
+		return chunks()
+
+	N = chunks[0].shape[0]
+	return (tuple(array[start:start+chunk_rows] for array in chunks)
+	        for start in range(0, N, chunk_rows))
+
+
+def sum_outer(W, Z, block_rows=None):
+
+	# Weighted sums of the outer products of the rows of Z, one for each
+	# column w of W: the M x P x P array of Z'diag(w)Z. It is computed as
+	# a single matrix product of W' with the row-wise outer products of
+	# Z, taken over blocks of about 2**22 entries.
+
+	N, P = Z.shape
+	if block_rows is None:
+		block_rows = max(1, 2**22 // (P*P))
+
+	acc = np.zeros((W.shape[1], P*P))
+	for start in range(0, N, block_rows):
+		Z_b = Z[start:start+block_rows]
+		ZZ_b = (Z_b[:, :, None] * Z_b[:, None, :]).reshape(-1, P*P)
+		acc += W[start:start+block_rows].T.dot(ZZ_b)
+
+	return acc.reshape(W.shape[1], P, P)
+
+
 def random_data(N=5000, K=3, unobservables=False, **kwargs):
 
 	"""
@@ -113,14 +181,144 @@ def random_data(N=5000, K=3, unobservables=False, **kwargs):
 		return Y, D, X
 
 
-def read_tsv(filepath):
+def read_tsv(filepath, Y=0, D=1, X=None):
+
+	"""
+	Reads outcomes, treatment indicators, and covariates from a
+	tab-separated file with a header row.
+
+	Only the selected columns are parsed, by NumPy's compiled text
+	reader. Blank lines are skipped.
+
+	Parameters
+	----------
+	filepath: string
+		File to read.
+	Y: int or string, optional
+		Position or header name of the outcome column.
+		Defaults to the first column.
+	D: int or string, optional
+		Position or header name of the treatment column.
+		Defaults to the second column.
+	X: list of ints or strings, optional
+		Positions or header names of the covariate columns.
+		Defaults to all columns other than Y and D, in order.
+
+	Returns
+	-------
+	tuple
+		A tuple in the form of (Y, D, X).
+	"""
+
+	return read_delimited(filepath, '\t', Y, D, X)
+
+
+def read_csv(filepath, Y=0, D=1, X=None):
+
+	"""
+	Same as read_tsv, but for comma-separated files.
+	"""
+
+	return read_delimited(filepath, ',', Y, D, X)
 
-	data = np.loadtxt(filepath, delimiter='\t', skiprows=1)
-	Y = data[:,0]
-	D = data[:,1]
-	X = data[:,2:]
 
-	return Y, D, X
+def read_delimited(filepath, delimiter, Y, D, X):
+
+	with open(filepath) as f:
+		names = f.readline().rstrip('\r\n').split(delimiter)
+		cols = [column_index(names, Y), column_index(names, D)]
+		if X is None:
+			cols += [j for j in range(len(names)) if j not in cols]
+		else:
+			cols += [column_index(names, x) for x in X]
+		data = np.loadtxt(f, delimiter=delimiter, usecols=cols, ndmin=2)
+
+	return data[:, 0], data[:, 1].astype(int), data[:, 2:]
+
+
+def column_index(names, col):
+
+	if isinstance(col, str):
+		if col not in names:
+			raise ValueError('Column ' + col + ' not found in header.')
+		return names.index(col)
+	else:
+		return col
+
+
+def write_npy(dirpath, Y, D, X):
+
+	"""
+	Saves outcomes, treatment indicators, and covariates in columnar
+	binary form, as the files Y.npy, D.npy, and X.npy in a directory,
+	so that they can later be memory-mapped by read_npy.
+
+	Parameters
+	----------
+	dirpath: string
+		Directory to write to. Created if it does not exist.
+	Y: array-like
+		Vector of observed outcomes.
+	D: array-like
+		Vector of treatment status indicators.
+	X: array-like
+		Matrix of covariates.
+	"""
+
+	if not path.isdir(dirpath):
+		os.makedirs(dirpath)
+
+	# store D as int and X as a 2-D array, so that Data need not copy them
+	X = np.asarray(X)
+	if X.ndim == 1:
+		X = X[:, None]
+	np.save(path.join(dirpath, 'Y.npy'), np.asarray(Y))
+	np.save(path.join(dirpath, 'D.npy'), np.asarray(D).astype(int))
+	np.save(path.join(dirpath, 'X.npy'), X)
+
+
+def read_npy(dirpath, mmap_mode='r'):
+
+	"""
+	Loads outcomes, treatment indicators, and covariates written by
+	write_npy. The arrays are memory-mapped rather than read into
+	memory, so loading takes constant time, and CausalModel uses them
+	without copying.
+
+	Parameters
+	----------
+	dirpath: string
+		Directory containing Y.npy, D.npy, and X.npy.
+	mmap_mode: {None, 'r', 'r+', 'c'}, optional
+		Memory-mapping mode passed to np.load. None reads the
+		arrays into memory. Defaults to 'r'.
+
+	Returns
+	-------
+	tuple
+		A tuple in the form of (Y, D, X).
+	"""
+
+	return tuple(np.load(path.join(dirpath, name+'.npy'),
+	                     mmap_mode=mmap_mode) for name in 'YDX')
+
+
+def tsv_to_npy(filepath, dirpath):
+
+	"""
+	Converts a tab-separated file in the format read by read_tsv
+	into the columnar binary format read by read_npy.
+
+	Parameters
+	----------
+	filepath: string
+		Tab-separated file with a header row, followed by columns
+		of outcomes, treatment indicators, and covariates.
+	dirpath: string
+		Directory to write Y.npy, D.npy, and X.npy to.
+	"""
+
+	write_npy(dirpath, *read_tsv(filepath))
 
 
 def vignette_data():
@@ -81,3 +81,36 @@ def test_blocking():
 	assert np.allclose(blocking3['atc_se'], atc_se3)
 	assert np.allclose(blocking3['att_se'], att_se3)
 
+
+
+def test_blocking_strata():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 15, 31, 8, 22])
+	D = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1])
+	X = np.array([[1], [3], [9], [12], [5], [4], [2], [6], [8], [7],
+	              [11], [10]])
+	pscore = np.array([0.15, 0.3, 0.85, 0.2, 0.6, 0.9,
+	                   0.1, 0.7, 0.25, 0.8, 0.55, 0.35])
+	causal = c.CausalModel(Y, D, X)
+	causal.raw_data._dict['pscore'] = pscore
+	causal.blocks = [0, 0.5, 1]
+	causal.stratify()
+	strata = causal.strata
+
+	for adj in (0, 1, 2):
+		blocking = b.Blocking(strata, adj)
+		models = [strata[i] for i in range(len(strata))]
+		for result in [b.Blocking(strata, adj, n_jobs=2),
+		               b.Blocking(models, adj)]:
+			for key in blocking.keys():
+				assert np.allclose(result[key], blocking[key])
+
+	causal.stratify()  # strata not yet built
+	blocking = b.Blocking(causal.strata, 2)
+	for stratum in causal.strata:
+		model = c.CausalModel(stratum.raw_data['Y'],
+		                      stratum.raw_data['D'], stratum.raw_data['X'])
+		model.est_via_ols(2)
+		for key in model.estimates['ols'].keys():
+			assert np.allclose(stratum.estimates['ols'][key],
+			                   model.estimates['ols'][key])
@@ -0,0 +1,68 @@
+from nose.tools import *
+import numpy as np
+
+import causalinference.estimators.bootstrap as bs
+import causalinference.estimators.ols as o
+import causalinference.estimators.weighting as w
+import causalinference.core.data as d
+
+
+def test_resample():
+
+	cells = np.array([0, 1, 0, 1, 1, 2, 2, 0, 1])
+	counts = bs.resample(cells, np.random.RandomState(0))
+
+	for cell in (0, 1, 2):
+		assert_equal(counts[cells==cell].sum(), (cells==cell).sum())
+	assert (counts >= 0).all()
+
+
+def test_ols_stat():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1])
+	X = np.array([[1, 42], [3, 32], [9, 7], [12, 86],
+	              [5, 94], [4, 36], [2, 13], [6, 61]])
+	counts = np.array([2, 1, 0, 3, 1, 2, 1, 2])
+	rows = np.repeat(np.arange(8), counts)
+
+	for adj in (0, 1, 2):
+		ols = o.OLS(d.Data(Y[rows], D[rows], X[rows]), adj)
+		stats = bs.ols_stat((Y, D, X), adj, counts.astype(float))
+		for key in stats.keys():
+			assert np.allclose(stats[key], ols[key])
+
+
+def test_weighting_stat():
+
+	Y = np.array([1, -2, 3, -5, 7, 4, 0])
+	D = np.array([0, 1, 0, 1, 0, 1, 1])
+	X = np.array([[3, 1], [2, 4], [3, 3], [5, 2], [5, 8], [1, 1], [6, 2]])
+	pscore = np.array([0.1, 0.25, 0.5, 0.75, 0.9, 0.4, 0.6])
+	counts = np.array([1, 2, 2, 0, 1, 3, 1])
+	rows = np.repeat(np.arange(7), counts)
+	data = d.Data(Y[rows], D[rows], X[rows])
+	data._dict['pscore'] = pscore[rows]
+
+	weighting = w.Weighting(data)
+	stats = bs.weighting_stat((Y, D, X, pscore), counts.astype(float))
+	assert np.allclose(stats['ate'], weighting['ate'])
+
+
+def test_bootstrap():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 16, 23, 9, 40])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1])
+	X = np.array([[1], [3], [9], [12], [5], [4], [2], [6], [8], [7],
+	              [11], [10]])
+	data = d.Data(Y, D, X)
+
+	boot1 = bs.Bootstrap(data, 'ols', 20, seed=42, adj=1)
+	boot2 = bs.Bootstrap(data, 'ols', 20, n_jobs=3, seed=42, adj=1)
+	ols = o.OLS(data, 1)
+	assert np.allclose(boot1['ate'], ols['ate'])
+	assert_equal(boot1['ate_reps'].shape, (20,))
+	assert np.array_equal(boot1['ate_reps'], boot2['ate_reps'])
+	assert np.allclose(boot1['ate_se'], boot1['ate_reps'].std(ddof=1))
+
+	assert_raises(ValueError, bs.Bootstrap, data, 'regression', 20)
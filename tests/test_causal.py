@@ -121,6 +121,109 @@ def test_est_via_ols():
 	assert_equal(set(causal.estimates['ols'].keys()), keys3)
 
 
+def test_stratify():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 15, 31])
+	D = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0, 1])
+	X = np.array([[1], [3], [9], [12], [5], [4], [2], [6], [8], [7]])
+	pscore = np.array([0.15, 0.3, 0.85, 0.2, 0.6,
+	                   0.9, 0.1, 0.7, 0.25, 0.8])
+	causal = c.CausalModel(Y, D, X)
+	causal.raw_data._dict['pscore'] = pscore
+	causal.blocks = [0, 0.5, 1]
+	causal.stratify()
+
+	assert_equal(len(causal.strata), 2)
+	assert_equal(causal.strata._strata, [None, None])  # built lazily
+
+	stratum = causal.strata[0]
+	assert_equal(set(stratum.raw_data['Y']), {52, 44, 15, 30, 29})
+	assert_equal(stratum.raw_data['N_c'], 3)
+	assert_equal(stratum.raw_data['N_t'], 2)
+	assert np.allclose(stratum.summary_stats['p_min'], 0.1)
+	assert np.allclose(stratum.summary_stats['p_c_mean'], 0.5/3)
+	assert causal.strata[-1] is causal.strata[1]
+	assert_raises(IndexError, causal.strata.__getitem__, 2)
+	assert_equal(causal.strata[1:], [causal.strata[1]])
+	assert_equal(causal.strata[::-1], [causal.strata[1], stratum])
+	assert_equal(causal.strata[2:], [])
+
+	causal.blocks = [0, 0.12, 1]
+	assert_raises(ValueError, causal.stratify)
+
+
+def test_trim():
+
+	rng = np.random.RandomState(0)
+	N, K = 500, 2
+	X = rng.normal(size=(N, K))
+	D = (rng.uniform(size=N) < 1/(1+np.exp(-X.sum(1)))).astype(int)
+	Y = 2*D + X.sum(1) + rng.normal(size=N)
+
+	causal = c.CausalModel(Y, D, X)
+	causal.est_propensity()
+	pscore = causal.raw_data['pscore']
+	keep = (pscore >= 0.1) & (pscore <= 0.9)
+	causal.trim()
+	assert np.array_equal(causal.raw_data['Y'], Y[keep])
+	assert np.array_equal(causal.raw_data['D'], D[keep])
+	assert np.array_equal(causal.raw_data['X'], X[keep])
+
+	causal.est_via_ols()
+	ate = causal.estimates['ols']['ate']
+	causal.est_via_ols(Y=np.column_stack([Y[keep], Y[keep]]))
+	assert np.allclose(causal.estimates['ols']['ate'], ate)
+
+
+def test_strata_required():
+
+	rng = np.random.RandomState(1)
+	X = rng.normal(size=(100, 2))
+	D = (rng.uniform(size=100) < 0.5).astype(int)
+	Y = D + X.sum(1) + rng.normal(size=100)
+
+	causal = c.CausalModel(Y, D, X)
+	causal.est_propensity()
+	assert_raises(ValueError, causal.bootstrap, 'blocking', 10)
+	assert_raises(ValueError, causal.permutation_test, within_strata=True)
+
+
+def test_float32():
+
+	# Accuracy of single-precision covariate storage against the default
+	# double-precision path. Observed deltas on this sample are about
+	# 1e-7 for propensity coefficients and weighting estimates, 1e-9
+	# for OLS estimates and covariate means, and zero for matching.
+
+	rng = np.random.RandomState(0)
+	N, K = 2000, 3
+	X = rng.normal(size=(N, K))
+	D = (rng.uniform(size=N) < 1/(1+np.exp(-X.sum(1)))).astype(int)
+	Y = 3*D + X.dot(np.ones(K)) + D*X.sum(1) + rng.normal(size=N)
+
+	models = [c.CausalModel(Y, D, X), c.CausalModel(Y, D, X, np.float32)]
+	for causal in models:
+		causal.est_propensity()
+		causal.est_via_ols()
+		causal.est_via_weighting()
+		causal.est_via_matching(search='blocked')
+	causal64, causal32 = models
+	assert_equal(causal32.raw_data['X'].dtype, np.float32)
+
+	assert np.allclose(causal32.summary_stats['X_c_mean'],
+	                   causal64.summary_stats['X_c_mean'], 0, 1e-6)
+	for key in ['coef', 'se']:
+		assert np.allclose(causal32.propensity[key],
+		                   causal64.propensity[key], 1e-5, 1e-6)
+	assert np.allclose(causal32.propensity['loglike'],
+	                   causal64.propensity['loglike'], 1e-8, 0)
+	for (method, tol) in [('ols', 1e-7), ('weighting', 1e-5),
+	                      ('matching', 1e-6)]:
+		for key in causal64.estimates[method].keys():
+			assert np.allclose(causal32.estimates[method][key],
+			                   causal64.estimates[method][key], tol, 0)
+
+
 def test_parse_lin_terms():
 
 	K1 = 4
@@ -188,6 +291,8 @@ def test_sumlessthan():
 	ans2 = np.array([12, 1, 3, 16, 12, 12])
 	assert np.array_equal(c.sumlessthan(g1, sg1, cs11), ans1)
 	assert np.array_equal(c.sumlessthan(g1, sg1, csg1), ans2)
+	assert np.array_equal(c.sumlessthan(g1, sg1, np.column_stack((cs11, csg1))),
+	                      np.column_stack((ans1, ans2)))
 
 	g2 = np.array([22, 4, 6, 4, 25, 5])
 	sg2 = np.array([4, 4, 5, 6, 22, 25])
@@ -211,36 +316,6 @@ def test_select_cutoff():
 	assert np.allclose(c.select_cutoff(g2), ans2)
 
 
-def test_calc_tstat():
-
-	sample1 = np.array([1, 1, 2, 2, 3, 3, 3, 3, 3, 3,
-	                    3, 3, 3, 3, 3, 3, 4, 4, 4, 5])
-	sample2 = np.array([5, 5, 5, 5, 5, 5, 5, 4, 4, 4, 4,
-	                    4, 4, 4, 4, 4, 4, 3, 3, 3, 2, 2])
-	ans = 3.632233
-
-	assert np.allclose(c.calc_tstat(sample1, sample2), ans)
-
-
-def test_calc_sample_sizes():
-
-	D1 = np.array([0, 1, 0, 1, 0, 1])
-	ans1 = (2, 1, 1, 2)
-	assert_equal(c.calc_sample_sizes(D1), ans1)
-
-	D2 = np.array([0, 1, 0, 1, 0])
-	ans2 = (1, 1, 2, 1)
-	assert_equal(c.calc_sample_sizes(D2), ans2)
-
-	D3 = np.array([1, 1, 1, 1, 1, 1])
-	ans3 = (0, 3, 0, 3)
-	assert_equal(c.calc_sample_sizes(D3), ans3)
-
-	D4 = np.array([0, 0, 0])
-	ans4 = (1, 0, 2, 0)
-	assert_equal(c.calc_sample_sizes(D4), ans4)
-
-
 def test_select_blocks():
 
 	pscore1 = np.array([0.05, 0.06, 0.3, 0.4, 0.5, 0.6, 0.7, 0.95, 0.95])
@@ -259,3 +334,21 @@ def test_select_blocks():
 	test2 = np.array(c.select_blocks(pscore2, logodds2, D2, K2, 0, 1))
 	assert np.allclose(test2, ans2)
 
+	np.random.seed(0)
+	pscore3 = np.linspace(0.01, 0.99, 2000)
+	D3 = (np.random.rand(2000) < pscore3).astype(int)
+	logodds3 = np.log(pscore3 / (1-pscore3))
+	K3 = 3
+	ends = [0, 125, 250, 500, 625, 750, 1000, 1250, 1375, 1500, 1625,
+	        1750, 1875, 1999]
+	ans3 = np.repeat(pscore3[ends], 2)[1:-1]
+	test3 = np.array(c.select_blocks(pscore3, logodds3, D3, K3, 0, 1))
+	assert np.allclose(test3, ans3)
+
+	pscore4 = np.repeat([0.2, 0.8], 10)
+	D4 = np.tile([0, 1], 10)
+	logodds4 = np.log(pscore4 / (1-pscore4))
+	K4 = 1
+	ans4 = np.array([0, 1])
+	test4 = np.array(c.select_blocks(pscore4, logodds4, D4, K4, 0, 1))
+	assert np.allclose(test4, ans4)
@@ -85,3 +85,21 @@ def test_data():
 	X2 = np.array([[-1, 2], [3, -4], [-5.6, -7], [8.9, 0.0]])
 	assert_raises(ValueError, d.Data, Y2, D2, X2)
 
+
+
+def test_data_splits():
+
+	Y = np.array([1.2, 3.45, -6, 78.90, -9, 8.7654])
+	D = np.array([0, 0, 0, 1, 1, 1])
+	X = np.array([[-1, 2], [3, -4], [-5.6, -7], [8.9, 0.0], [99, 877], [-666, 54321]])
+	data = d.Data(Y, D, X)
+
+	assert 'X_c' not in data._dict
+	assert 'X_c' in data.keys()
+	assert np.shares_memory(data['X_c'], X)
+	assert np.shares_memory(data['Y_t'], Y)
+	assert np.array_equal(data['X_t'], X[3:])
+
+	data = d.Data(Y[::-1], D[::-1], X[::-1])
+	assert np.shares_memory(data['X_c'], X)
+	assert np.array_equal(data['Y_c'], np.array([-6, 3.45, 1.2]))
@@ -73,12 +73,123 @@ def test_match():
 	assert_equal(set(m.match(X_i, X_m, W2, m2)), set(ans2))
 
 
+def test_whiten():
+
+	X = np.array([[1, 7, 3], [4, 2, 5], [9, 8, 6]])
+	W1 = np.array([0.5, 1, 0.25])
+	W2 = np.array([[2, 0.5, 0], [0.5, 1, 0.2], [0, 0.2, 3]])
+
+	for W in (W1, W2):
+		Xw = m.whiten(X, W)
+		dist = ((Xw[1:] - Xw[0])**2).sum(1)
+		assert np.allclose(dist, m.norm(X[0], X[1:], W))
+
+
+def test_match_all():
+
+	np.random.seed(0)
+	X = np.random.random_integers(0, 3, (40, 2)).astype(float)
+	X_m = np.random.random_integers(0, 3, (30, 2)).astype(float)
+	W1 = np.array([0.5, 2])
+	W2 = np.array([[2, 0.5], [0.5, 1]])
+
+	for W in (W1, W2):
+		for n in (1, 3):
+			brute = m.match_all(X, X_m, W, n, 'brute')
+			kdtree = m.match_all(X, X_m, W, n, 'kdtree')
+			blocked = m.match_all(X, X_m, W, n, 'blocked', 1000)
+			parallel = m.match_all(X, X_m, W, n, 'kdtree',
+			                       n_jobs=3, part_size=7)
+			for idx1, idx2, idx3 in zip(brute, kdtree, blocked):
+				assert_equal(set(idx1), set(idx2))
+				assert_equal(set(idx1), set(idx3))
+			assert_equal(len(parallel), len(kdtree))
+			for idx1, idx2 in zip(kdtree, parallel):
+				assert np.array_equal(idx1, idx2)
+
+	assert_raises(ValueError, m.match_all, X, X_m, W1, 1, 'foo')
+	assert_raises(ValueError, m.match_all, X, X_m, W1, 1, 'brute', eps=0.5)
+	assert_raises(ValueError, m.match_all, X, X_m, W1, 1, 'blocked',
+	              eps=0.5)
+
+
+def test_match_blocked_offset():
+
+	rng = np.random.RandomState(0)
+	X = rng.normal(size=(200, 2)) + np.array([1e4, -3e3])
+	X_m = rng.normal(size=(150, 2)) + np.array([1e4, -3e3])
+	W = np.array([2, 0.5])
+
+	blocked = m.match_all(X, X_m, W, 2, 'blocked', 2**16)
+	brute = m.match_all(X, X_m, W, 2, 'brute')
+	for idx1, idx2 in zip(blocked, brute):
+		assert_equal(set(idx1), set(idx2))
+
+
+def test_match_blocked_float32():
+
+	rng = np.random.RandomState(1)
+	N = 400
+	X = np.column_stack((rng.normal(40, 10, N), rng.normal(2000, 3, N)))
+	X = X.astype(np.float32)
+	W = 1 / X.var(0, dtype=np.float64)
+
+	blocked = m.match_all(X[:250], X[250:], W, 1, 'blocked', 2**16)
+	kdtree = m.match_all(X[:250], X[250:], W, 1, 'kdtree')
+	for idx1, idx2 in zip(blocked, kdtree):
+		assert_equal(set(idx1), set(idx2))
+
+
+def test_csr_matches():
+
+	lists = [np.array([3, 0, 1]), np.array([7]), np.array([1, 9])]
+	matches = m.csr_matches(lists)
+	assert np.array_equal(matches.indptr, np.array([0, 3, 4, 6]))
+	assert np.array_equal(matches.indices, np.array([3, 0, 1, 7, 1, 9]))
+	assert np.allclose(matches.weights, np.array([1/3, 1, 1/2]))
+	assert_equal(len(matches), 3)
+	assert np.array_equal(matches[-1], lists[2])
+
+	parts = [m.csr_matches(lists[:1]), m.csr_matches(lists[1:])]
+	stacked = m.concat_matches(parts)
+	assert np.array_equal(stacked.indptr, matches.indptr)
+	assert np.array_equal(stacked.indices, matches.indices)
+
+
+def test_match_means():
+
+	Y_m = np.array([4, 2, 5, 2])
+	matches = m.csr_matches([np.array([1, 0, 2]), np.array([3]),
+	                         np.array([2, 0])])
+
+	ans = np.array([11/3, 2, 4.5])
+	assert np.allclose(m.match_means(Y_m, matches), ans)
+
+
+def test_calc_inflation():
+
+	np.random.seed(0)
+	X = np.random.rand(200, 3)
+	X_m = np.random.rand(300, 3)
+	W = np.array([1, 2, 0.5])
+
+	exact = m.match_all(X, X_m, W, 2, 'kdtree')
+	assert_equal(m.calc_inflation(X, X_m, W, 2, exact), 0)
+
+	eps = 0.5
+	approx = m.match_all(X, X_m, W, 2, 'kdtree', eps=eps)
+	assert all(len(idx) == 2 for idx in approx)
+	inflation = m.calc_inflation(X, X_m, W, 2, approx, 50)
+	assert 0 <= inflation <= eps
+
+
 def test_bias_coefs():
 
 	Y_m = np.array([4, 2, 5, 2])
 	X_m = np.array([[7, 6], [5, 4], [2, 3], [3, 5]])
-	matches = [np.array([1, 0, 2]), np.array([1, 2]),
-	           np.array([2, 0]), np.array([0]), np.array([0, 1])]
+	matches = m.csr_matches([np.array([1, 0, 2]), np.array([1, 2]),
+	                         np.array([2, 0]), np.array([0]),
+	                         np.array([0, 1])])
 
 	ans = np.array([-2, 3])
 	assert np.allclose(m.bias_coefs(matches, Y_m, X_m), ans)
@@ -88,7 +199,7 @@ def test_bias():
 
 	X = np.array([[1, 2, 3], [-3, -2, -1]])
 	X_m = np.array([[4, 2, 6], [5, 7, 3], [9, 4, 1]])
-	matches = [np.array([0, 1, 2]), np.array([1])]
+	matches = m.csr_matches([np.array([0, 1, 2]), np.array([1])])
 	coefs = np.array([-2, 0, 3])
 
 	ans = np.array([-9, -4])
@@ -98,7 +209,8 @@ def test_bias():
 def test_scaled_counts():
 
 	N = 10
-	matches = [np.array([3, 0, 1]), np.array([7]), np.array([1, 9])]
+	matches = m.csr_matches([np.array([3, 0, 1]), np.array([7]),
+	                         np.array([1, 9])])
 
 	ans = np.array([1/3, 1/3+1/2, 0, 1/3, 0, 0, 0, 1, 0, 1/2])
 	assert np.allclose(m.scaled_counts(N, matches), ans)
@@ -25,6 +25,16 @@ def test_form_matrix():
 	assert np.array_equal(o.form_matrix(D, X, adj3), ans3)
 
 
+def test_calc_coef():
+
+	Z = np.array([[1, 0, 2], [1, 1, 5], [1, 0, 1], [1, 1, 3], [1, 0, 7]])
+	Y = np.array([[3, 1], [4, -2], [1, 0], [8, 5], [2, 2]])
+
+	ans = np.linalg.lstsq(Z, Y, rcond=None)[0]
+	assert np.allclose(o.calc_coef(Z, Y), ans)
+	assert np.allclose(o.calc_coef(Z, Y[:, 0]), ans[:, 0])
+
+
 def test_calc_ate():
 
 	olscoef = np.array([1, 2, 3, 4])
@@ -64,6 +74,36 @@ def test_calc_cov():
 	assert np.allclose(o.calc_cov(Z, u), ans)
 
 
+def test_calc_cov_blocks():
+
+	Z = np.array([[1, 0, 2], [1, 1, 5], [1, 0, 1], [1, 1, 3], [1, 0, 7]])
+	u = np.array([[1, 0.5], [-2, 1], [0.5, -1], [3, 2], [-1, 0.25]])
+
+	A = np.linalg.inv(Z.T.dot(Z))
+	for j in range(u.shape[1]):
+		B = (u[:, j][:, None]*Z).dot(A)
+		ans = B.T.dot(B)
+		assert np.allclose(o.calc_cov(Z, u[:, j], block_rows=2), ans)
+		assert np.allclose(o.calc_cov(Z, u, block_rows=3)[j], ans)
+
+	R = np.linalg.qr(Z, mode='r')
+	assert np.allclose(o.calc_cov(Z, u, R), o.calc_cov(Z, u))
+
+
+def test_calc_cov_wild():
+
+	Z = np.array([[1, 0, 2], [1, 1, 5], [1, 0, 1], [1, 1, 3], [1, 0, 7]])
+	u = np.array([[1, 0.5], [-2, 1], [0.5, -1], [3, 2], [-1, 0.25]])
+
+	cov = o.calc_cov(Z, u)
+	cov_wild = o.calc_cov_wild(Z, u, B=20000, seed=0, block_rows=2)
+	assert np.allclose(cov_wild, cov, rtol=0.1, atol=0.01)
+	for j in range(u.shape[1]):
+		cov_j = o.calc_cov_wild(Z, u[:, j], B=20000, seed=0,
+		                        block_rows=2)
+		assert np.allclose(cov_j, cov_wild[j])
+
+
 def test_submatrix():
 
 	cov = np.array([[1, 2, 3, 4, 5, 6], [7, 9, 8, 9, 8, 7],
@@ -136,3 +176,44 @@ def test_ols():
 	assert np.allclose(ols3['att_se'], att_se3)
 	assert_equal(set(ols3.keys()), keys3)
 
+
+
+def test_ols_multi():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1])
+	X = np.array([[1, 42], [3, 32], [9, 7], [12, 86],
+	              [5, 94], [4, 36], [2, 13], [6, 61]])
+	data = d.Data(Y, D, X)
+	Y_multi = np.column_stack((Y, np.log(Y), X[:, 0]**2))
+
+	for adj in (0, 1, 2):
+		ols_multi = o.OLS(data, adj, Y_multi)
+		for j in range(Y_multi.shape[1]):
+			data_j = d.Data(Y_multi[:, j], D, X)
+			ols_j = o.OLS(data_j, adj)
+			for key in ols_j.keys():
+				assert np.allclose(ols_multi[key][j], ols_j[key])
+
+	assert_raises(IndexError, o.OLS, data, 2, Y_multi[:-1])
+	assert_raises(ValueError, o.OLS, data, 2, se='bootstrap')
+
+
+def test_chunked_ols():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 16, 23])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1, 0, 1])
+	X = np.array([[1, 42], [3, 32], [9, 7], [12, 86], [5, 94],
+	              [4, 36], [2, 13], [6, 61], [7, 25], [8, 50]])
+	data = d.Data(Y, D, X)
+
+	def gen_chunks():
+		for (start, stop) in [(0, 4), (4, 7), (7, 10)]:
+			yield (Y[start:stop], D[start:stop], X[start:stop])
+
+	for adj in (0, 1, 2):
+		ols = o.OLS(data, adj)
+		for chunks in [(Y, D, X), gen_chunks]:
+			chunked = o.ChunkedOLS(chunks, adj, chunk_rows=3)
+			for key in ols.keys():
+				assert np.allclose(chunked[key], ols[key])
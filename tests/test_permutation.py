@@ -0,0 +1,86 @@
+from __future__ import division
+from nose.tools import *
+import numpy as np
+
+import causalinference.core.permutation as p
+import causalinference.core.data as d
+import causalinference.estimators.ols as o
+
+
+def test_permute():
+
+	D = np.array([0, 1, 1, 0, 1, 0, 0, 1, 1])
+	groups = np.array([0, 0, 1, 1, 1, 2, 2, 2, 2])
+	Dmat = p.permute(D, groups, 50, np.random.RandomState(0))
+
+	assert_equal(Dmat.shape, (9, 50))
+	for group in (0, 1, 2):
+		sums = Dmat[groups==group].sum(0)
+		assert (sums == D[groups==group].sum()).all()
+	assert not (Dmat == D[:, None]).all()
+
+
+def test_calc_rdiff():
+
+	Y = np.array([3, 1, 4, 1, 5, 9])
+	Dmat = np.array([[0, 1], [1, 1], [0, 0], [1, 0], [0, 0], [1, 1]])
+
+	ans = np.array([11/3 - 4, 13/3 - 10/3])
+	assert np.allclose(p.calc_rdiff(Y, Dmat), ans)
+
+
+def test_calc_ols_ate():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 16, 23])
+	X = np.array([[1, 42], [3, 32], [9, 7], [12, 86], [5, 94],
+	              [4, 36], [2, 13], [6, 61], [7, 25], [8, 50]])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1, 0, 1])
+	Dmat = p.permute(D, np.zeros(10, dtype=int), 4,
+	                 np.random.RandomState(1))
+
+	for adj in (0, 1, 2):
+		prep = p.prepare_ols(Y, X, adj)
+		ates = p.calc_ols_ate(prep, Dmat)
+		for j in range(4):
+			ols = o.OLS(d.Data(Y, Dmat[:, j], X), adj)
+			assert np.allclose(ates[j], ols['ate'])
+
+
+def test_permutation():
+
+	Y = np.array([52, 30, 5, 29, 12, 10, 44, 87, 16, 23])
+	D = np.array([0, 0, 0, 0, 1, 1, 1, 1, 0, 1])
+	X = np.array([[1], [3], [9], [12], [5], [4], [2], [6], [8], [7]])
+	data = d.Data(Y, D, X)
+
+	perm1 = p.Permutation(data, 'rdiff', 500, seed=3, batch=64)
+	perm2 = p.Permutation(data, 'rdiff', 500, seed=3, batch=64, n_jobs=3)
+	assert np.allclose(perm1['observed'], Y[D==1].mean()-Y[D==0].mean())
+	assert_equal(perm1['P'], 500)
+	assert np.array_equal(perm1['null'], perm2['null'])
+	exceed = (np.abs(perm1['null']) >=
+	          np.abs(perm1['observed'])*(1-1e-12)).sum()
+	assert np.allclose(perm1['p_value'], (1+exceed)/501)
+
+	perm3 = p.Permutation(data, 'ols', 10000, seed=3, batch=50, tol=0.05)
+	assert perm3['P'] < 10000
+	assert perm3['p_value_se'] <= 0.05
+
+	assert_raises(ValueError, p.Permutation, data, 'matching')
+
+
+def test_permutation_ties():
+
+	# The observed assignment has the largest statistic, so only the
+	# permutations that reproduce it, or its mirror image, count.
+	Y = np.array([0.1, 0.7, 0.3, 10.2, 10.9, 10.6])
+	D = np.array([0, 0, 0, 1, 1, 1])
+	X = np.array([[0.3], [0.1], [0.4], [0.1], [0.5], [0.9]])
+	data = d.Data(Y, D, X)
+
+	for statistic in ('rdiff', 'ols'):
+		perm = p.Permutation(data, statistic, 400, seed=0, batch=64)
+		ties = np.isclose(np.abs(perm['null']), np.abs(perm['observed']),
+		                  rtol=1e-9, atol=0).sum()
+		assert ties > 0
+		assert np.allclose(perm['p_value'], (1+ties)/401)
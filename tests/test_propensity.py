@@ -1,5 +1,6 @@
 from nose.tools import *
 import numpy as np
+import warnings
 
 import causalinference.core.data as d
 import causalinference.core.propensity as p
@@ -71,6 +72,27 @@ def test_calc_coef():
 	ans = np.array([-6.9441137, 0.6608454, 0.4900669])
 
 	assert np.allclose(p.calc_coef(X_c, X_t), ans)
+	assert np.allclose(p.calc_coef(X_c, X_t, 'bfgs'), ans)
+	assert_raises(ValueError, p.calc_coef, X_c, X_t, 'foo')
+
+
+def test_newton():
+
+	X_c = np.array([[1, 1, 8], [1, 8, 5], [1, 3, 3]])
+	X_t = np.array([[1, 10, 2], [1, 5, 8], [1, 2, 4]])
+	Z = np.vstack((X_c, X_t))
+
+	beta, H_chol = p.newton(X_c, X_t)
+	assert np.allclose(p.neg_gradient(beta, X_c, X_t), 0, atol=1e-8)
+	phat = p.sigmoid(Z.dot(beta))
+	assert np.allclose(p.calc_se_chol(H_chol), p.calc_se(Z, phat))
+
+	with warnings.catch_warnings(record=True) as caught:
+		warnings.simplefilter('always')
+		beta, H_chol = p.newton(X_c, X_t, maxiter=1)
+	assert_equal(len(caught), 1)
+	phat = p.sigmoid(Z.dot(beta))
+	assert np.allclose(p.calc_se_chol(H_chol), p.calc_se(Z, phat))
 
 
 def test_calc_se():
@@ -52,6 +52,44 @@ def test_calc_loglike():
 	assert np.allclose(p.calc_loglike(X_c, X_t, lin, qua), ans)
 
 
+def test_column_cache():
+
+	X = np.array([[1, 3], [5, 7], [8, 6], [4, 2]])
+	cache = p.ColumnCache(X, max_mem=2*8*4)  # room for two columns
+
+	out = np.empty(4)
+	cache.fill(1, out)
+	assert np.array_equal(out, np.array([3, 7, 6, 2]))
+	cache.fill((0, 1), out)
+	assert np.array_equal(out, np.array([3, 35, 48, 8]))
+	cache.fill(1, out)
+	cache.fill((1, 1), out)  # evicts (0, 1)
+	assert np.array_equal(out, np.array([9, 49, 36, 4]))
+	assert_equal(list(cache._slots.keys()), [1, (1, 1)])
+
+	mat = p.form_matrix_cached(cache, [0], [(0, 1), (1, 1)], extra=1)
+	ans = np.array([[1, 1, 3, 9], [1, 5, 35, 49],
+	                [1, 8, 48, 36], [1, 4, 8, 4]])
+	assert np.array_equal(mat[:, :-1], ans)
+	assert_equal(mat.shape, (4, 5))
+	assert mat.flags['F_CONTIGUOUS']
+
+
+def test_calc_lr_stats():
+
+	X_c = np.array([[1, 2, 5], [3, 7, 1], [2, 2, 2], [5, 1, 0]])
+	X_t = np.array([[1, 4, 3], [3, 6, 2], [6, 2, 1], [4, 4, 4]])
+	caches = (p.ColumnCache(X_c), p.ColumnCache(X_t))
+	lin, qua = [1], []
+	candidates = [0, 2]
+
+	ll_null = p.calc_loglike(X_c, X_t, lin, qua)
+	ans = [2 * (p.calc_loglike(X_c, X_t, lin+[term], qua) - ll_null)
+	       for term in candidates]
+	out = p.calc_lr_stats(caches, lin, qua, candidates)
+	assert np.allclose(out, ans)
+
+
 def test_select_lin():
 
 	Y, D, X = random_data(K=4)
@@ -211,6 +249,20 @@ def test_select_qua_terms():
 	assert_equal(p.select_qua_terms(X_c, X_t, lin5, C5), ans5)
 
 
+def test_select_parallel():
+
+	Y, D, X = random_data(N=60, K=4)
+	X_c, X_t = X[D==0], X[D==1]
+
+	lin1 = p.select_lin_terms(X_c, X_t, [], 0.5)
+	lin2 = p.select_lin_terms(X_c, X_t, [], 0.5, n_jobs=3)
+	assert_equal(lin1, lin2)
+
+	qua1 = p.select_qua_terms(X_c, X_t, lin1, 0.5)
+	qua2 = p.select_qua_terms(X_c, X_t, lin1, 0.5, n_jobs=3)
+	assert_equal(qua1, qua2)
+
+
 def test_propensityselect():
 
 	D = np.array([0, 0, 0, 1, 1, 1])
@@ -0,0 +1,89 @@
+from __future__ import division
+from nose.tools import *
+import numpy as np
+
+import causalinference.estimators.sweep as s
+import causalinference.causal as c
+
+
+def random_model(seed):
+
+	rng = np.random.RandomState(seed)
+	N, K = 400, 2
+	X = rng.normal(size=(N, K))
+	D = (X[:, 0] + rng.normal(size=N) > 0).astype(int)
+	Y = 1 + 2*D + X.dot([1, -1]) + D*X[:, 1] + rng.normal(size=N)
+	causal = c.CausalModel(Y, D, X)
+	causal.est_propensity()
+
+	return causal
+
+
+def test_nest_units():
+
+	pscore = np.array([0.9, 0.1, 0.5, 0.09999999999999999, 0.95, 0.7,
+	                   0.3, 0.2, 0.8, 0.05])
+	cutoffs = np.array([0.1, 0, 0.3, 0.2, 0.1])
+	order, sizes = s.nest_units(pscore, cutoffs)
+
+	for (cutoff, size) in zip(cutoffs, sizes):
+		keep = (pscore >= cutoff) & (pscore <= 1-cutoff)
+		assert_equal(size, keep.sum())
+		assert keep[order[:size]].all()
+
+
+def test_merge_moments():
+
+	values = np.array([[3., 1.], [4., 1.], [5., 9.], [2., 6.], [5., 3.]])
+	moments = (0, np.zeros(2), np.zeros(2))
+	for (start, end) in [(0, 2), (2, 2), (2, 5)]:
+		moments = s.merge_moments(moments, values[start:end])
+
+	assert_equal(moments[0], 5)
+	assert np.allclose(moments[1], values.mean(0))
+	assert np.allclose(moments[2], values.var(0)*5)
+
+
+def test_sweep():
+
+	cutoffs = [0.1, 0, 0.25, 0.1, 0.05]
+	causal = random_model(0)
+	causal.trim_sweep(cutoffs, ['ols', 'weighting'])
+	sweep = causal.sweep
+	assert_equal(len(sweep['N']), 5)
+
+	for (j, cutoff) in enumerate(cutoffs):
+		model = random_model(0)
+		model.cutoff = cutoff
+		model.trim()
+		model.est_via_ols()
+		model.est_via_weighting()
+		summary = model.summary_stats
+		for name in ['N', 'N_c', 'N_t', 'rdiff', 'Y_t_sd', 'X_c_mean',
+		             'X_t_sd', 'ndiff']:
+			assert np.allclose(sweep[name][j], summary[name])
+		for method in ['ols', 'weighting']:
+			for name in model.estimates[method].keys():
+				assert np.allclose(sweep[method][name][j],
+				                   model.estimates[method][name])
+
+
+def test_sweep_block_rows():
+
+	causal = random_model(1)
+	cutoffs = np.linspace(0, 0.3, 7)
+	sweep1 = s.Sweep(causal.raw_data, cutoffs, ['ols', 'weighting'], 1)
+	sweep2 = s.Sweep(causal.raw_data, cutoffs, ['ols', 'weighting'], 1,
+	                 block_rows=16)
+
+	for method in ['ols', 'weighting']:
+		for name in sweep1[method].keys():
+			assert np.allclose(sweep1[method][name], sweep2[method][name])
+
+
+def test_sweep_invalid():
+
+	causal = random_model(2)
+	assert_raises(ValueError, causal.trim_sweep, [0.1], ['matching'])
+	assert_raises(ValueError, causal.trim_sweep, [0.6])
+	assert_raises(ValueError, causal.trim_sweep, [-0.1])
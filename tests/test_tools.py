@@ -1,7 +1,11 @@
 from nose.tools import *
 import numpy as np
+import os
+import shutil
+import tempfile
 
 import causalinference.utils.tools as t
+import causalinference.core.data as d
 
 
 def test_convert_to_formatting():
@@ -59,3 +63,64 @@ def test_gen_reg_entries():
 	assert np.allclose(lw, ans6)
 	assert np.allclose(up, ans7)
 
+
+def test_sum_outer():
+
+	Z = np.array([[1, 2], [3, 5], [-1, 4], [2, 0], [7, 1]])
+	W = np.array([[1, 0.5], [2, 0], [0, 1], [3, 3], [1, 2]])
+
+	ans = np.array([Z.T.dot(W[:, m, None]*Z) for m in range(2)])
+	assert np.allclose(t.sum_outer(W, Z), ans)
+	assert np.allclose(t.sum_outer(W, Z, block_rows=2), ans)
+
+
+def test_npy():
+
+	dirpath = tempfile.mkdtemp()
+	try:
+		t.tsv_to_npy(t.lalonde_file, dirpath)
+		Y, D, X = t.read_npy(dirpath)
+		Y_ans, D_ans, X_ans = t.read_tsv(t.lalonde_file)
+		assert isinstance(X, np.memmap)
+		assert np.array_equal(Y, Y_ans)
+		assert np.array_equal(D, D_ans)
+		assert np.array_equal(X, X_ans)
+
+		data = d.Data(Y, D, X)
+		assert data['X'] is X
+		assert data['D'] is D
+	finally:
+		shutil.rmtree(dirpath)
+
+
+def test_read_tsv():
+
+	data = np.loadtxt(t.lalonde_file, delimiter='\t', skiprows=1)
+	Y, D, X = t.read_tsv(t.lalonde_file)
+	assert np.array_equal(Y, data[:, 0])
+	assert np.array_equal(D, data[:, 1])
+	assert np.array_equal(X, data[:, 2:])
+
+	Y, D, X = t.read_tsv(t.lalonde_file, 're78', 't', ['educ', 'age'])
+	assert np.array_equal(Y, data[:, 0])
+	assert np.array_equal(X, data[:, [7, 4]])
+	assert_raises(ValueError, t.read_tsv, t.lalonde_file, 'income')
+
+
+def test_read_csv():
+
+	dirpath = tempfile.mkdtemp()
+	try:
+		filepath = os.path.join(dirpath, 'data.csv')
+		with open(filepath, 'w') as f:
+			f.write('x1,d,y,x2\n1.5,0,2,-3\n2,1,-1.25,4e2\r\n\n0,1,3,5\n\n')
+		Y, D, X = t.read_csv(filepath, 'y', 'd')
+		assert np.array_equal(Y, np.array([2, -1.25, 3]))
+		assert np.array_equal(D, np.array([0, 1, 1]))
+		assert np.array_equal(X, np.array([[1.5, -3], [2, 400], [0, 5]]))
+
+		with open(filepath, 'w') as f:
+			f.write('y,d,x\n1,0,2\n2,1\n')
+		assert_raises(ValueError, t.read_csv, filepath)
+	finally:
+		shutil.rmtree(dirpath)
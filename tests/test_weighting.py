@@ -49,3 +49,27 @@ def test_weighting():
 	assert np.allclose(weighting['ate_se'], ate_se)
 	assert_equal(set(weighting.keys()), keys)
 
+
+
+def test_chunked_weighting():
+
+	Y = np.array([1, -2, 3, -5, 7, 4, 0])
+	D = np.array([0, 1, 0, 1, 0, 1, 1])
+	X = np.array([[3, 1], [2, 4], [3, 3], [5, 2], [5, 8], [1, 1], [6, 2]])
+	pscore = np.array([0.1, 0.25, 0.5, 0.75, 0.9, 0.4, 0.6])
+	data = d.Data(Y, D, X)
+	data._dict['pscore'] = pscore
+
+	weighting = w.Weighting(data)
+	blocked = w.Weighting(data, block_rows=2)
+	chunked = w.ChunkedWeighting((Y, D, X, pscore), chunk_rows=3)
+	for key in weighting.keys():
+		assert np.allclose(blocked[key], weighting[key])
+		assert np.allclose(chunked[key], weighting[key])
+
+	wild1 = w.Weighting(data, se='wild', B=20000, seed=1)
+	wild2 = w.Weighting(data, se='wild', B=20000, seed=1)
+	assert_equal(wild1['ate'], weighting['ate'])
+	assert_equal(wild1['ate_se'], wild2['ate_se'])
+	assert np.allclose(wild1['ate_se'], weighting['ate_se'], rtol=0.05)
+	assert_raises(ValueError, w.Weighting, data, se='jackknife')